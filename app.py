@@ -1,11 +1,16 @@
 from flask import (
     Flask,
+    Request,
+    abort,
     render_template,
     request,
     redirect,
     url_for,
     flash,
+    g,
+    has_request_context,
     jsonify,
+    session,
 )
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
@@ -16,32 +21,435 @@ from flask_login import (
     login_required,
     current_user,
 )
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+    safe_join,
+)
+from werkzeug.datastructures import Headers
+from werkzeug.utils import secure_filename, send_file as werkzeug_send_file
 import os
+import atexit
+import base64
+import bisect
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
 from datetime import datetime, timedelta
-from sqlalchemy import inspect, text
+from sqlalchemy import func, inspect, text
+from sqlalchemy.exc import DBAPIError, DataError, IntegrityError, StatementError
+from sqlalchemy.orm import make_transient_to_detached
 import secrets
 import smtplib
+import sqlite3
+import tempfile
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from flask_wtf.csrf import CSRFProtect
+from itsdangerous import BadSignature, SignatureExpired, TimestampSigner
 import traceback
 import logging
-from urllib.parse import quote
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from urllib.parse import quote, unquote
+import urllib.request
+from markupsafe import Markup
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; uploads are then served as-is
+    Image = ImageOps = None
+
+try:
+    import brotli
+except ImportError:  # responses fall back to gzip
+    brotli = None
+
+try:
+    import redis
+except ImportError:  # rate limiting then uses SQLite or memory storage
+    redis = None
 
 app = Flask(__name__)
 app.config.from_object("config.Config")
 app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 60 * 60 * 24 * 30  # 30 days
 
 
+# Content-addressed uploads (and the variants derived from them) never
+# change under the same name, so browsers may cache them for a year.
+UPLOAD_HASH_LENGTH = 32
+IMMUTABLE_UPLOAD_RE = re.compile(
+    r"^/static/uploads/.+/[0-9a-f]{%d}(?:-\d+w)?\.[a-z0-9]+$" % UPLOAD_HASH_LENGTH
+)
+
+
 @app.after_request
 def add_static_cache_headers(response):
-    if request.path.startswith("/static/"):
+    if IMMUTABLE_UPLOAD_RE.match(request.path) or asset_manifest.is_fingerprinted(
+        request.path
+    ):
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    elif request.path.startswith("/static/"):
         response.headers["Cache-Control"] = "public, max-age=2592000"
     return response
 
 
+# --- Static file offload ----------------------------------------------------
+# With STATIC_OFFLOAD set, /static/ requests are answered with headers only and
+# the fronting proxy streams the bytes: 'x-sendfile' (Apache mod_xsendfile,
+# lighttpd) passes the absolute path, 'x-accel-redirect' (nginx) an internal
+# URI under STATIC_OFFLOAD_PREFIX.  Flask still resolves the file and answers
+# conditional requests (304/412) itself; Range requests are left to the proxy,
+# which serves partial content for internal redirects natively.
+STATIC_OFFLOAD_MODES = ("x-sendfile", "x-accel-redirect")
+
+
+# Precompressed siblings written by scripts/build_assets.py, best first.
+PRECOMPRESSED_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+PRECOMPRESSED_EXTENSIONS = {"css", "js", "json", "svg", "txt", "xml", "map", "ico"}
+_precompressed_siblings = {}
+
+
+def precompressed_siblings(path):
+    """Return the encodings with a precompressed sibling of path (cached)."""
+    found = _precompressed_siblings.get(path)
+    if found is None:
+        found = tuple(
+            encoding
+            for encoding, suffix in PRECOMPRESSED_ENCODINGS
+            if os.path.isfile(path + suffix)
+        )
+        _precompressed_siblings[path] = found
+    return found
+
+
+def serve_static(filename):
+    path = safe_join(app.static_folder, filename) and static_url_to_path(
+        f"/static/{filename}"
+    )
+    if not path or not os.path.isfile(path):
+        abort(404)
+
+    mode = app.config.get("STATIC_OFFLOAD", "off")
+    offload = mode in STATIC_OFFLOAD_MODES
+    encoding = None
+    negotiable = (
+        not filename.startswith("uploads/")
+        and get_file_extension(filename) in PRECOMPRESSED_EXTENSIONS
+    )
+    if negotiable:
+        for candidate in precompressed_siblings(path):
+            if request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+    suffix = dict(PRECOMPRESSED_ENCODINGS).get(encoding, "")
+
+    response = werkzeug_send_file(
+        os.path.abspath(path + suffix),
+        request.environ,
+        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        conditional=not offload,
+        max_age=app.get_send_file_max_age(filename),
+        use_x_sendfile=offload,
+        response_class=app.response_class,
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    if negotiable:
+        response.vary.add("Accept-Encoding")
+    if not offload:
+        return response
+
+    response.headers["Accept-Ranges"] = "bytes"
+    if mode == "x-accel-redirect":
+        del response.headers["X-Sendfile"]
+        response.headers["X-Accel-Redirect"] = app.config[
+            "STATIC_OFFLOAD_PREFIX"
+        ].rstrip("/") + quote(f"/{filename}{suffix}")
+    response.make_conditional(request.environ)
+    if response.status_code != 200:
+        response.headers.pop("X-Sendfile", None)
+        response.headers.pop("X-Accel-Redirect", None)
+    return response
+
+
+app.view_functions["static"] = serve_static
+
+
+class OffloadEmulator:
+    """WSGI stand-in for the fronting proxy, for development and tests.
+
+    Replaces responses carrying X-Sendfile / X-Accel-Redirect with the file
+    itself, including Range and If-Range handling.  Enable with
+    STATIC_OFFLOAD_EMULATE; never needed behind a real proxy.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def _resolve(self, headers):
+        if "X-Sendfile" in headers:
+            return headers["X-Sendfile"]
+        internal = headers.get("X-Accel-Redirect")
+        prefix = app.config["STATIC_OFFLOAD_PREFIX"].rstrip("/") + "/"
+        if internal and internal.startswith(prefix):
+            return static_url_to_path("/static/" + unquote(internal[len(prefix) :]))
+        return None
+
+    def __call__(self, environ, start_response):
+        if not app.config.get("STATIC_OFFLOAD_EMULATE"):
+            return self.wsgi_app(environ, start_response)
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured["status"], captured["headers"] = status, headers
+            return lambda data: None
+
+        body = self.wsgi_app(environ, capture)
+        headers = Headers(captured["headers"])
+        path = self._resolve(headers)
+        if not path or not os.path.isfile(path):
+            start_response(captured["status"], captured["headers"])
+            return body
+        if hasattr(body, "close"):
+            body.close()
+        response = werkzeug_send_file(path, environ, conditional=True)
+        for name in ("Cache-Control", "Vary", "Content-Type", "Content-Encoding"):
+            if name in headers:
+                response.headers[name] = headers[name]
+        return response(environ, start_response)
+
+
+app.wsgi_app = OffloadEmulator(app.wsgi_app)
+
+
+# --- Asset fingerprinting -----------------------------------------------------
+# scripts/build_assets.py writes content-hashed copies of static files and a
+# manifest mapping `css/style.css` -> `css/style.3f9a1c2b4d5e.css`.  url_for
+# ('static', ...) emits the hashed name when the manifest has one, so those
+# URLs can be cached forever; without a manifest the plain names are used.
+class AssetManifest:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None
+        self._hashed_urls = frozenset()
+
+    def _load(self):
+        path = os.path.join(app.static_folder, app.config["ASSET_MANIFEST"])
+        try:
+            with open(path, encoding="utf-8") as fh:
+                entries = json.load(fh)
+        except FileNotFoundError:
+            entries = {}
+        except (OSError, ValueError) as e:
+            app.logger.warning("Could not read asset manifest %s: %s", path, e)
+            entries = {}
+        self._hashed_urls = frozenset(f"/static/{name}" for name in entries.values())
+        self._entries = entries
+
+    def _ensure_loaded(self):
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._load()
+
+    def lookup(self, filename):
+        """Return the fingerprinted name for a static filename, if any."""
+        if not app.config.get("ASSET_FINGERPRINTING", True):
+            return filename
+        self._ensure_loaded()
+        return self._entries.get(filename, filename)
+
+    def is_fingerprinted(self, path):
+        """True when a request path is one of the hashed asset URLs."""
+        if not path.startswith("/static/"):
+            return False
+        self._ensure_loaded()
+        return path in self._hashed_urls
+
+    def reload(self):
+        with self._lock:
+            self._load()
+
+
+asset_manifest = AssetManifest()
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        values["filename"] = asset_manifest.lookup(values["filename"])
+        as_type = PRELOAD_TYPES.get(get_file_extension(values["filename"]))
+        if as_type and not values.get("_external"):
+            record_preload(f"{app.static_url_path}/{values['filename']}", as_type)
+
+
+# static/css/tailwind.css is a build output (scripts/build_assets.py); until a
+# build has produced it, base.html falls back to the Tailwind CDN script.
+@app.template_global()
+def compiled_tailwind():
+    return os.path.isfile(os.path.join(app.static_folder, "css", "tailwind.css"))
+
+
+# --- Critical CSS -----------------------------------------------------------------
+# scripts/build_critical_css.py writes the above-the-fold rules of each public
+# page to static/critical/<endpoint>.css.  base.html inlines them through
+# critical_css() and then loads the full stylesheets without blocking render.
+CRITICAL_CSS_DIR = "critical"
+_critical_css_cache = {}
+
+
+@app.template_global()
+def critical_css():
+    """Inline critical CSS for the current endpoint, or None."""
+    endpoint = request.endpoint
+    if not endpoint or not app.config.get("CRITICAL_CSS", True):
+        return None
+    if endpoint not in _critical_css_cache:
+        path = os.path.join(app.static_folder, CRITICAL_CSS_DIR, f"{endpoint}.css")
+        try:
+            with open(path, encoding="utf-8") as fh:
+                css = fh.read().replace("</", "<\\/")
+        except OSError:
+            css = ""
+        _critical_css_cache[endpoint] = Markup(css) if css else None
+    return _critical_css_cache[endpoint]
+
+
+# --- Preload hints ------------------------------------------------------------------
+# While a page renders, every stylesheet and script it references through
+# url_for('static', ...) — plus images flagged with preload_hint(), such as
+# the hero — is recorded.  The HTML response carries them as `Link: rel=
+# preload` headers, and the set learned per endpoint is sent ahead of the
+# view as 103 Early Hints when the WSGI server offers `wsgi.early_hints`.
+# CDNs that turn Link headers into Early Hints (e.g. Cloudflare) also work.
+PRELOAD_TYPES = {"css": "style", "js": "script", "woff2": "font"}
+_endpoint_preloads = {}
+
+
+def record_preload(url, as_type, **attrs):
+    if not has_request_context() or not app.config.get("PRELOAD_HINTS", True):
+        return
+    if "preloads" not in g:
+        g.preloads = {}
+    g.preloads.setdefault(url, (as_type, attrs))
+
+
+def format_preload(url, as_type, attrs):
+    parts = [f"<{url}>", "rel=preload", f"as={as_type}"]
+    if as_type == "font":
+        parts.append("crossorigin")
+    parts.extend(f'{name}="{value}"' for name, value in sorted(attrs.items()))
+    return "; ".join(parts)
+
+
+@app.template_global()
+def preload_hint(url, as_type="image", **attrs):
+    """Ask for a preload of url on this page; renders as nothing."""
+    record_preload(url, as_type, **attrs)
+    return ""
+
+
+@app.before_request
+def send_early_hints():
+    early_hints = request.environ.get("wsgi.early_hints")
+    links = _endpoint_preloads.get(request.endpoint)
+    if links and callable(early_hints):
+        try:
+            early_hints([("Link", link) for link in links])
+        except Exception as e:
+            app.logger.debug("Early hints not sent: %s", e)
+
+
+@app.after_request
+def add_preload_headers(response):
+    preloads = g.pop("preloads", None)
+    if not preloads or response.status_code != 200 or response.mimetype != "text/html":
+        return response
+    links = tuple(
+        format_preload(url, as_type, attrs) for url, (as_type, attrs) in preloads.items()
+    )
+    _endpoint_preloads[request.endpoint] = links
+    response.headers.add("Link", ", ".join(links))
+    return response
+
+
+# --- Response compression -------------------------------------------------------
+# Dynamic text responses (rendered pages, JSON) are compressed once.  Flask
+# runs after_request hooks in reverse registration order, so this hook, the
+# last one registered, runs first; the earlier ones (cache headers, preload
+# Link headers) only set headers and must leave the body and Vary alone.
+# Static files are streamed with direct_passthrough and carry their own
+# precompressed variants, so they are never touched here; nor is anything
+# streamed or already encoded.
+COMPRESSIBLE_MIMETYPES = {
+    "text/html",
+    "text/plain",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+}
+
+
+def compress_payload(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=app.config["COMPRESS_BROTLI_QUALITY"])
+    return gzip.compress(data, compresslevel=app.config["COMPRESS_GZIP_LEVEL"])
+
+
+def negotiate_response_encoding():
+    """Pick 'br' or 'gzip' from Accept-Encoding, or None."""
+    accept = request.accept_encodings
+    candidates = [("br", accept["br"])] if brotli is not None else []
+    candidates.append(("gzip", accept["gzip"]))
+    encoding, quality = max(candidates, key=lambda c: c[1])
+    return encoding if quality > 0 else None
+
+
+@app.after_request
+def compress_response(response):
+    if not app.config.get("COMPRESS_RESPONSES", True):
+        return response
+    if (
+        response.direct_passthrough
+        or response.is_streamed
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or "Content-Encoding" in response.headers
+        or response.status_code in (204, 206, 304)
+        or response.status_code < 200
+    ):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+    encoding = negotiate_response_encoding()
+    if encoding is None:
+        return response
+
+    response.set_data(compress_payload(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak=weak)
+    return response
+
+
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = "admin_login"
@@ -235,12 +643,46 @@ DEFAULT_ADS = [
 ]
 
 
+def parse_tag_list(raw):
+    """Split a comma-separated string into unique, whitespace-normalized names.
+
+    Order is preserved; later duplicates (compared case-insensitively) are
+    dropped.
+    """
+    names = []
+    seen = set()
+    for part in (raw or "").split(","):
+        name = " ".join(part.split())
+        slug = tag_slug(name)
+        if name and slug not in seen:
+            seen.add(slug)
+            names.append(name)
+    return names
+
+
+def tag_slug(name):
+    """Normalized lookup key for a tag name ("Power  BI" -> "power bi")."""
+    return " ".join((name or "").split()).casefold()
+
+
+# The seed content is immutable, so split its comma-joined fields once here
+# instead of on every render.
+_SERVICES_FALLBACK = [
+    {**service, "id": idx + 1, "detail_list": parse_tag_list(service["details"])}
+    for idx, service in enumerate(DEFAULT_SERVICES)
+]
+_PORTFOLIO_FALLBACK = [
+    {**item, "technology_list": parse_tag_list(item.get("technologies"))}
+    for item in DEFAULT_PORTFOLIO
+]
+
+
 def get_services_fallback():
-    return [{**service, "id": idx + 1} for idx, service in enumerate(DEFAULT_SERVICES)]
+    return list(_SERVICES_FALLBACK)
 
 
 def get_portfolio_fallback():
-    return list(DEFAULT_PORTFOLIO)
+    return list(_PORTFOLIO_FALLBACK)
 
 
 # Database Models
@@ -251,6 +693,14 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @property
+    def session_generation(self):
+        """Changes whenever the password does, ending every older session."""
+        return hashlib.sha256((self.password_hash or "").encode()).hexdigest()[:12]
+
+    def get_id(self):
+        return f"{self.id}:{self.session_generation}"
+
 
 class ContactMessage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -261,6 +711,8 @@ class ContactMessage(db.Model):
     message = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_read = db.Column(db.Boolean, default=False)
+    # Set once the message has gone out in a contact digest
+    notified_at = db.Column(db.DateTime, index=True)
 
 
 class Service(db.Model):
@@ -271,8 +723,33 @@ class Service(db.Model):
     details = db.Column(db.Text)
     category = db.Column(db.String(100))  # Added category field
 
+    # Normalized copy of `details`, kept in sync by sync_tags()
+    detail_links = db.relationship(
+        "ServiceTag",
+        order_by="ServiceTag.position",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+
+    @property
+    def detail_list(self):
+        return [link.tag.name for link in self.detail_links]
+
+
+class ImageMetadataMixin:
+    """Intrinsic size, dominant color and blur placeholder of `image_url`.
 
-class Portfolio(db.Model):
+    Filled by apply_image_metadata() when the image changes, so pages can
+    reserve the box and paint a preview before the image arrives.
+    """
+
+    image_width = db.Column(db.Integer)
+    image_height = db.Column(db.Integer)
+    image_color = db.Column(db.String(7))  # '#rrggbb'
+    image_placeholder = db.Column(db.Text)  # data: URI of a ~16px preview
+
+
+class Portfolio(ImageMetadataMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     client = db.Column(db.String(200))
@@ -288,240 +765,2891 @@ class Portfolio(db.Model):
     featured = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    # Serves the /portfolio listing: filter by category (and optionally
+    # featured), ordered by featured then newest first.
+    __table_args__ = (
+        db.Index(
+            "ix_portfolio_category_featured_created",
+            "category",
+            "featured",
+            "created_at",
+        ),
+        db.Index("ix_portfolio_featured_created", "featured", "created_at"),
+    )
+
+    # Normalized copy of `technologies`, kept in sync by sync_tags()
+    technology_links = db.relationship(
+        "PortfolioTag",
+        order_by="PortfolioTag.position",
+        cascade="all, delete-orphan",
+        lazy="selectin",
+    )
+
+    @property
+    def technology_list(self):
+        return [link.tag.name for link in self.technology_links]
+
+
+TAG_KIND_TECHNOLOGY = "technology"
+TAG_KIND_SERVICE_DETAIL = "service_detail"
+
+
+class Tag(db.Model):
+    """A normalized tag name, e.g. a portfolio technology or a service detail."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    # Text like Service.details, which service detail names come from
+    name = db.Column(db.Text, nullable=False)
+    slug = db.Column(db.Text, nullable=False)
+
+    __table_args__ = (db.UniqueConstraint("kind", "slug", name="uq_tag_kind_slug"),)
+
+
+class PortfolioTag(db.Model):
+    portfolio_id = db.Column(
+        db.Integer, db.ForeignKey("portfolio.id", ondelete="CASCADE"), primary_key=True
+    )
+    tag_id = db.Column(
+        db.Integer, db.ForeignKey("tag.id"), primary_key=True, index=True
+    )
+    position = db.Column(db.Integer, default=0)
+
+    tag = db.relationship("Tag", lazy="joined")
+
+
+class ServiceTag(db.Model):
+    service_id = db.Column(
+        db.Integer, db.ForeignKey("service.id", ondelete="CASCADE"), primary_key=True
+    )
+    tag_id = db.Column(
+        db.Integer, db.ForeignKey("tag.id"), primary_key=True, index=True
+    )
+    position = db.Column(db.Integer, default=0)
+
+    tag = db.relationship("Tag", lazy="joined")
+
+
+class PasswordResetToken(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    token = db.Column(db.String(100), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    is_used = db.Column(db.Boolean, default=False)
+
+    user = db.relationship("User", backref="reset_tokens")
+
+
+class OutboundEmail(db.Model):
+    """A queued email; see the outbound email section."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    to_address = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    text_body = db.Column(db.Text, nullable=False)
+    html_body = db.Column(db.Text)
+    # 'pending', 'sending' (claimed until next_attempt_at), 'sent' or 'failed'
+    status = db.Column(db.String(10), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index("ix_outbound_email_due", "status", "next_attempt_at"),)
+
+
+class Advertisement(ImageMetadataMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    cta_text = db.Column(db.String(100), default="Learn More")
+    cta_link = db.Column(db.String(500))
+    image_url = db.Column(db.String(500))
+    background_color = db.Column(db.String(50), default="#2563eb")
+    text_color = db.Column(db.String(50), default="#ffffff")
+    is_active = db.Column(db.Boolean, default=True)
+    start_date = db.Column(db.DateTime, default=datetime.utcnow)
+    end_date = db.Column(db.DateTime)
+    display_order = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class UploadBlob(db.Model):
+    """A stored upload, named by its content hash and shared by every row using it."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    url = db.Column(db.String(500), unique=True, nullable=False)
+    size = db.Column(db.Integer)
+    original_name = db.Column(db.String(255))
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class UploadReference(db.Model):
+    """Which row's image_url points at which UploadBlob."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner_type = db.Column(db.String(50), nullable=False)  # table name
+    owner_id = db.Column(db.Integer, nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey("upload_blob.id"), nullable=False, index=True)
+
+    blob = db.relationship("UploadBlob")
+
+    __table_args__ = (
+        db.UniqueConstraint("owner_type", "owner_id", name="uq_upload_reference_owner"),
+    )
+
+
+class ImageVariant(db.Model):
+    """An optimized copy (format and/or width) generated from an uploaded image."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    source_url = db.Column(db.String(500), nullable=False, index=True)
+    url = db.Column(db.String(500), nullable=False)
+    format = db.Column(db.String(10), nullable=False)  # 'webp', 'avif', 'original'
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    bytes = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# --- Normalized tags -------------------------------------------------------
+# `Portfolio.technologies` and `Service.details` stay as the comma-separated
+# strings the admin forms edit, but every write also stores them as Tag rows
+# so templates get ready-made lists and /portfolio?tech= can use an index.
+_TAG_LINK_MODELS = {
+    TAG_KIND_TECHNOLOGY: ("technology_links", PortfolioTag),
+    TAG_KIND_SERVICE_DETAIL: ("detail_links", ServiceTag),
+}
+
+
+def sync_tags(owner, raw, kind):
+    """Replace the tag links of a Portfolio/Service with the names in `raw`.
+
+    Missing Tag rows are created and tags left without any links are
+    deleted; the caller commits the session.
+    """
+    attr, link_model = _TAG_LINK_MODELS[kind]
+    previous_ids = {link.tag_id for link in getattr(owner, attr) if link.tag_id}
+    names = parse_tag_list(raw)
+    slugs = [tag_slug(name) for name in names]
+
+    # Tags created earlier in this session (e.g. during a backfill) are not
+    # flushed yet, so look at the pending objects before querying.
+    existing = {
+        obj.slug: obj
+        for obj in db.session.new
+        if isinstance(obj, Tag) and obj.kind == kind
+    }
+    missing = [slug for slug in slugs if slug not in existing]
+    if missing:
+        with db.session.no_autoflush:
+            for tag in Tag.query.filter(Tag.kind == kind, Tag.slug.in_(missing)):
+                existing[tag.slug] = tag
+
+    links = []
+    for position, (name, slug) in enumerate(zip(names, slugs)):
+        tag = existing.get(slug)
+        if tag is None:
+            tag = Tag(kind=kind, name=name, slug=slug)
+            db.session.add(tag)
+            existing[slug] = tag
+        links.append(link_model(tag=tag, position=position))
+    setattr(owner, attr, links)
+    delete_orphan_tags(previous_ids)
+
+
+def owner_tag_ids(owner):
+    """Ids of the tags a Portfolio/Service links to (collect before deleting it)."""
+    return {
+        link.tag_id
+        for attr, _ in _TAG_LINK_MODELS.values()
+        for link in getattr(owner, attr, [])
+    }
+
+
+def delete_orphan_tags(tag_ids):
+    """Delete those of tag_ids that no portfolio item or service links to."""
+    if not tag_ids:
+        return
+    db.session.flush()
+    db.session.execute(
+        db.delete(Tag).where(
+            Tag.id.in_(tag_ids),
+            Tag.id.notin_(db.select(PortfolioTag.tag_id)),
+            Tag.id.notin_(db.select(ServiceTag.tag_id)),
+        ),
+        execution_options={"synchronize_session": "fetch"},
+    )
+
+
+def backfill_tags():
+    """Create tag rows for portfolio items and services saved before tags existed."""
+    updated = 0
+    portfolio_items = Portfolio.query.filter(
+        Portfolio.technologies.isnot(None),
+        Portfolio.technologies != "",
+        ~Portfolio.technology_links.any(),
+    ).all()
+    for item in portfolio_items:
+        sync_tags(item, item.technologies, TAG_KIND_TECHNOLOGY)
+        updated += 1
+
+    services_list = Service.query.filter(
+        Service.details.isnot(None),
+        Service.details != "",
+        ~Service.detail_links.any(),
+    ).all()
+    for service in services_list:
+        sync_tags(service, service.details, TAG_KIND_SERVICE_DETAIL)
+        updated += 1
+
+    if updated:
+        db.session.commit()
+    return updated
+
+
+# --- Portfolio facet index ------------------------------------------------
+# The public portfolio filter bar needs the list of categories and how many
+# projects (and featured projects) each one has.  Rather than running a
+# DISTINCT/COUNT on every page view we keep the counts in memory, rebuild
+# them with a single GROUP BY after portfolio writes, and let them expire
+# after PORTFOLIO_FACET_TTL so other gunicorn workers pick up changes too.
+class PortfolioFacetIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._facets = None
+        self._built_at = 0.0
+
+    @staticmethod
+    def _empty():
+        return {"total": 0, "featured": 0, "categories": {}, "source": "db"}
+
+    @classmethod
+    def _add(cls, facets, category, featured, count):
+        facets["total"] += count
+        if featured:
+            facets["featured"] += count
+        if not category:
+            return
+        bucket = facets["categories"].setdefault(category, {"total": 0, "featured": 0})
+        bucket["total"] += count
+        if featured:
+            bucket["featured"] += count
+
+    @classmethod
+    def from_items(cls, items, source="fallback"):
+        """Build facet counts from dict items (e.g. DEFAULT_PORTFOLIO)."""
+        facets = cls._empty()
+        facets["source"] = source
+        for item in items:
+            cls._add(facets, item.get("category"), bool(item.get("featured")), 1)
+        return facets
+
+    def _build(self):
+        rows = (
+            db.session.query(Portfolio.category, Portfolio.featured, func.count())
+            .group_by(Portfolio.category, Portfolio.featured)
+            .all()
+        )
+        facets = self._empty()
+        for category, featured, count in rows:
+            self._add(facets, category, bool(featured), count)
+        if facets["total"] == 0:
+            facets = self.from_items(get_portfolio_fallback())
+        return facets
+
+    def get(self):
+        """Return the current facet counts, rebuilding them if stale."""
+        ttl = app.config.get("PORTFOLIO_FACET_TTL", 300)
+        with self._lock:
+            if self._facets is None or time.monotonic() - self._built_at > ttl:
+                self._facets = self._build()
+                self._built_at = time.monotonic()
+            return self._facets
+
+    def invalidate(self):
+        """Drop the cached counts; call after committing a portfolio write."""
+        with self._lock:
+            self._facets = None
+
+
+portfolio_facets = PortfolioFacetIndex()
+
+
+def filter_portfolio_fallback(category="all", featured_only=False, tech=""):
+    """Filter the default portfolio the same way the /portfolio query does."""
+    tech_slug = tag_slug(tech)
+    return [
+        item
+        for item in get_portfolio_fallback()
+        if (category == "all" or item.get("category") == category)
+        and (not featured_only or item.get("featured"))
+        and (
+            not tech_slug
+            or tech_slug in (tag_slug(name) for name in item["technology_list"])
+        )
+    ]
+
+
+# --- Site search ------------------------------------------------------------
+# /search is answered from an in-process inverted index over services and
+# portfolio items.  It is built once per worker (from the database, or from
+# DEFAULT_SERVICES / DEFAULT_PORTFOLIO when a table is empty), patched after
+# each admin write, and rebuilt after SEARCH_INDEX_TTL so writes made in
+# other workers show up.  Queries never touch the database.
+_SEARCH_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def search_tokens(text_value):
+    """Lower-case word tokens of a string (accents and case folded)."""
+    decomposed = unicodedata.normalize("NFKD", (text_value or "").casefold())
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _SEARCH_TOKEN_RE.findall(folded)
+
+
+class SearchIndex:
+    """Inverted index with BM25 ranking and prefix matching."""
+
+    # Per-field term weights: a hit in a title counts for more than one in a
+    # testimonial.
+    FIELD_WEIGHTS = {
+        "title": 3.0,
+        "client": 1.5,
+        "technologies": 2.0,
+        "details": 1.5,
+        "category": 1.5,
+        "description": 1.0,
+        "testimonial": 0.5,
+    }
+    K1 = 1.2
+    B = 0.75
+    # Terms only matched as a prefix of the query word score at this weight.
+    PREFIX_WEIGHT = 0.6
+    MAX_PREFIX_EXPANSIONS = 50
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._docs = {}  # key -> result metadata
+        self._doc_len = {}  # key -> weighted length
+        self._doc_terms = {}  # key -> set of terms (for removal)
+        self._postings = {}  # term -> {key: weighted tf}
+        self._total_len = 0.0
+        self._sorted_terms = []
+        self._terms_dirty = False
+        self._fallback_kinds = set()
+
+    # -- documents ---------------------------------------------------------
+    @staticmethod
+    def _get(obj, name):
+        return obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+
+    def _service_doc(self, service):
+        get = self._get
+        return (
+            {
+                "title": get(service, "title"),
+                "description": get(service, "description"),
+                "details": get(service, "details"),
+                "category": get(service, "category"),
+            },
+            {
+                "kind": "service",
+                "title": get(service, "title"),
+                "summary": get(service, "description") or "",
+                "category": get(service, "category"),
+                "endpoint": "services",
+                "url_values": {"_anchor": f"service-{get(service, 'id')}"},
+            },
+        )
+
+    def _portfolio_doc(self, item):
+        get = self._get
+        return (
+            {
+                "title": get(item, "title"),
+                "client": get(item, "client"),
+                "description": get(item, "description"),
+                "technologies": get(item, "technologies"),
+                "testimonial": get(item, "testimonial"),
+                "category": get(item, "category"),
+            },
+            {
+                "kind": "portfolio",
+                "title": get(item, "title"),
+                "summary": get(item, "description") or "",
+                "category": get(item, "category"),
+                "client": get(item, "client"),
+                "endpoint": "portfolio",
+                "url_values": {"category": get(item, "category") or "all"},
+            },
+        )
+
+    def _add(self, key, fields, meta):
+        self._remove(key)
+        weighted_tf = {}
+        length = 0.0
+        for field, value in fields.items():
+            weight = self.FIELD_WEIGHTS.get(field, 1.0)
+            for term in search_tokens(value):
+                weighted_tf[term] = weighted_tf.get(term, 0.0) + weight
+                length += weight
+        for term, tf in weighted_tf.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._terms_dirty = True
+            postings[key] = tf
+        self._docs[key] = meta
+        self._doc_len[key] = length
+        self._doc_terms[key] = set(weighted_tf)
+        self._total_len += length
+
+    def _remove(self, key):
+        if key not in self._docs:
+            return
+        for term in self._doc_terms.pop(key):
+            postings = self._postings[term]
+            postings.pop(key, None)
+            if not postings:
+                del self._postings[term]
+                self._terms_dirty = True
+        self._total_len -= self._doc_len.pop(key)
+        del self._docs[key]
+
+    def _clear(self):
+        self._docs.clear()
+        self._doc_len.clear()
+        self._doc_terms.clear()
+        self._postings.clear()
+        self._total_len = 0.0
+        self._terms_dirty = True
+        self._fallback_kinds = set()
+
+    # -- building ----------------------------------------------------------
+    def rebuild(self):
+        """(Re)build the whole index; falls back to seed content if empty."""
+        try:
+            services_list = Service.query.order_by(Service.id).all()
+            portfolio_items = Portfolio.query.all()
+        except Exception as e:
+            app.logger.warning("Search index using seed content: %s", e)
+            db.session.rollback()
+            services_list, portfolio_items = [], []
+        with self._lock:
+            self._clear()
+            if not services_list:
+                services_list = get_services_fallback()
+                self._fallback_kinds.add("service")
+            if not portfolio_items:
+                portfolio_items = [
+                    {**item, "id": f"seed-{idx}"}
+                    for idx, item in enumerate(get_portfolio_fallback())
+                ]
+                self._fallback_kinds.add("portfolio")
+            for service in services_list:
+                self._add(f"service:{self._get(service, 'id')}", *self._service_doc(service))
+            for item in portfolio_items:
+                self._add(f"portfolio:{self._get(item, 'id')}", *self._portfolio_doc(item))
+            self._built_at = time.monotonic()
+
+    def ensure_built(self):
+        ttl = app.config.get("SEARCH_INDEX_TTL", 300)
+        if self._built_at is None or time.monotonic() - self._built_at > ttl:
+            self.rebuild()
+
+    def index_service(self, service):
+        """Add or refresh one service after it has been committed."""
+        if "service" in self._fallback_kinds:
+            return self.rebuild()
+        with self._lock:
+            self._add(f"service:{service.id}", *self._service_doc(service))
+
+    def index_portfolio(self, item):
+        """Add or refresh one portfolio item after it has been committed."""
+        if "portfolio" in self._fallback_kinds:
+            return self.rebuild()
+        with self._lock:
+            self._add(f"portfolio:{item.id}", *self._portfolio_doc(item))
+
+    def remove(self, kind, item_id):
+        with self._lock:
+            self._remove(f"{kind}:{item_id}")
+
+    # -- querying ----------------------------------------------------------
+    def _expand(self, token):
+        """Yield (term, weight) for an exact match and prefix completions."""
+        if self._terms_dirty:
+            self._sorted_terms = sorted(self._postings)
+            self._terms_dirty = False
+        terms = self._sorted_terms
+        start = bisect.bisect_left(terms, token)
+        for term in terms[start : start + self.MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            yield term, 1.0 if term == token else self.PREFIX_WEIGHT
+
+    def search(self, query, limit=20):
+        """Return up to `limit` result dicts ordered by BM25 score."""
+        tokens = list(dict.fromkeys(search_tokens(query)))
+        if not tokens:
+            return []
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return []
+            avg_len = self._total_len / n_docs or 1.0
+            scores = {}
+            matched = {}
+            for token in tokens:
+                token_scores = {}
+                for term, weight in self._expand(token):
+                    postings = self._postings[term]
+                    df = len(postings)
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    for key, tf in postings.items():
+                        norm = self.K1 * (1 - self.B + self.B * self._doc_len[key] / avg_len)
+                        score = weight * idf * tf * (self.K1 + 1) / (tf + norm)
+                        # A query word counts once per document: keep its
+                        # best-matching expansion.
+                        if score > token_scores.get(key, 0.0):
+                            token_scores[key] = score
+                for key, score in token_scores.items():
+                    scores[key] = scores.get(key, 0.0) + score
+                    matched[key] = matched.get(key, 0) + 1
+            # Documents matching every query word rank above partial matches.
+            ranked = sorted(scores, key=lambda k: (matched[k], scores[k]), reverse=True)
+            return [
+                {**self._docs[key], "score": round(scores[key], 4)}
+                for key in ranked[:limit]
+            ]
+
+
+search_index = SearchIndex()
+
+
+# --- Lazy DB initialization (essential for Vercel / serverless) ----------
+# On Vercel the `if __name__ == '__main__'` block never executes, so
+# `init_db()` would never be called.  We use a `before_request` hook
+# to create tables and seed data on the very first request of each
+# cold-start.
+_db_initialized = False
+
+
+@app.before_request
+def ensure_db_initialized():
+    global _db_initialized
+    if not _db_initialized and app.config.get("INIT_DB_ON_REQUEST", True):
+        try:
+            db.create_all()
+            init_db()
+        except Exception as e:
+            app.logger.warning("Lazy DB init failed: %s", e)
+        _db_initialized = True
+
+
+# --- Authenticated user cache ---------------------------------------------------
+# Every admin request (and each of a page's AJAX calls) loads current_user.
+# The session stores "<id>:<generation>" (see User.get_id), and this worker
+# keeps the user's column values for USER_CACHE_TTL seconds, so most
+# requests rebuild the user without a query.  A password change alters the
+# generation, which both misses the cache and rejects older sessions;
+# invalidate() drops the entry at once on this worker, and other workers
+# follow within the TTL.
+class UserIdentityCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # user id -> (generation, expires_at, column values)
+
+    def get(self, user_id, generation):
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry and entry[0] == generation and entry[1] > time.monotonic():
+            return entry[2]
+        return None
+
+    def put(self, user):
+        ttl = app.config.get("USER_CACHE_TTL", 30)
+        if ttl <= 0:
+            return
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        with self._lock:
+            self._entries[user.id] = (user.session_generation, time.monotonic() + ttl, values)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+user_cache = UserIdentityCache()
+
+
+@login_manager.user_loader
+def load_user(session_id):
+    user_id, sep, generation = session_id.partition(":")
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    if not sep:
+        return load_legacy_session_user(user_id)
+    values = user_cache.get(user_id, generation)
+    if values is not None:
+        # Attach a copy to this request's session without a SELECT
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    try:
+        user = db.session.get(User, user_id)
+    except Exception:
+        return None
+    if user is None or user.session_generation != generation:
+        return None  # unknown user, or a session from before a password change
+    user_cache.put(user)
+    return user
+
+
+def load_legacy_session_user(user_id):
+    """Accept a bare "<id>" session from before generations were added and
+    rotate it (and any remember-me cookie) to the "<id>:<generation>" form."""
+    if not app.config.get("ACCEPT_LEGACY_SESSION_IDS", True):
+        return None
+    try:
+        user = db.session.get(User, user_id)
+    except Exception:
+        return None
+    if user is None:
+        return None
+    session["_user_id"] = user.get_id()
+    remember_cookie = app.config.get("REMEMBER_COOKIE_NAME", "remember_token")
+    if remember_cookie in request.cookies:
+        session["_remember"] = "set"
+    return user
+
+
+# --- Password hashing ---------------------------------------------------------
+# Hashing is deliberately slow and runs inline: with sync gunicorn workers
+# each process handles one request at a time, so at most one hash per worker
+# runs at once and the worker count bounds the CPU spent on logins.  Stored
+# hashes made with other parameters than PASSWORD_HASH_METHOD are replaced
+# on the next successful login.
+# Werkzeug's defaults for the parameters a method string may leave out
+PASSWORD_METHOD_DEFAULTS = {
+    "pbkdf2": ("sha256", str(DEFAULT_PBKDF2_ITERATIONS)),
+    "scrypt": ("32768", "8", "1"),
+}
+
+
+def hash_password(password):
+    return generate_password_hash(password, app.config["PASSWORD_HASH_METHOD"])
+
+
+def verify_password(password_hash, password):
+    """True if password matches the stored hash; malformed hashes never match."""
+    if not password_hash or not password:
+        return False
+    try:
+        return check_password_hash(password_hash, password)
+    except Exception:
+        return False
+
+
+def password_method_prefix(method):
+    """The "method" part Werkzeug writes before the first '$' of a hash,
+    e.g. 'pbkdf2' -> 'pbkdf2:sha256:600000', 'scrypt' -> 'scrypt:32768:8:1'."""
+    name, *params = method.split(":")
+    defaults = PASSWORD_METHOD_DEFAULTS.get(name)
+    if defaults is None:
+        return method
+    params += defaults[len(params):]
+    return ":".join([name, *params])
+
+
+def password_needs_rehash(password_hash):
+    """True when a stored hash was not made with PASSWORD_HASH_METHOD."""
+    prefix = password_method_prefix(app.config["PASSWORD_HASH_METHOD"])
+    return password_hash.split("$", 1)[0] != prefix
+
+
+def generate_reset_token():
+    """Generate a secure reset token"""
+    return secrets.token_urlsafe(32)
+
+
+def get_file_extension(filename):
+    """Extract lowercase file extension from a filename."""
+    if not filename or "." not in filename:
+        return ""
+    return filename.rsplit(".", 1)[1].lower()
+
+
+def is_allowed_file(filename):
+    """Check if uploaded file has an allowed extension."""
+    return get_file_extension(filename) in app.config["ALLOWED_EXTENSIONS"]
+
+
+def has_uploaded_file(field_name):
+    """Check if a real file was submitted in the given form field."""
+    if field_name not in request.files:
+        return False
+    f = request.files[field_name]
+    return f and f.filename and f.filename.strip() != ""
+
+
+# Leading bytes every accepted image type must start with.  Extensions are
+# only a hint from the client; this stops e.g. an HTML file renamed to .png.
+_ISO_BMFF_BRANDS = {
+    "avif": (b"avif", b"avis"),
+    "heic": (b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1"),
+    "heif": (b"heic", b"heix", b"hevc", b"hevx", b"mif1", b"msf1"),
+}
+IMAGE_SIGNATURES = {
+    "jpg": (b"\xff\xd8\xff",),
+    "jpeg": (b"\xff\xd8\xff",),
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "gif": (b"GIF87a", b"GIF89a"),
+    "bmp": (b"BM",),
+    "tif": (b"II*\x00", b"MM\x00*"),
+    "tiff": (b"II*\x00", b"MM\x00*"),
+    "ico": (b"\x00\x00\x01\x00",),
+}
+SNIFF_BYTES = 512
+
+
+def sniff_image_type(head, ext):
+    """Return True if `head` (the first bytes of a file) matches `ext`."""
+    if ext in IMAGE_SIGNATURES:
+        return head.startswith(IMAGE_SIGNATURES[ext])
+    if ext == "webp":
+        return head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+    if ext in _ISO_BMFF_BRANDS:
+        return head[4:8] == b"ftyp" and head[8:12] in _ISO_BMFF_BRANDS[ext]
+    if ext == "svg":
+        text_head = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+        return text_head.startswith((b"<?xml", b"<svg", b"<!--", b"<!doctype svg"))
+    return False
+
+
+def upload_size_limit(ext):
+    """Largest accepted size in bytes for an upload with this extension."""
+    return app.config["UPLOAD_SIZE_LIMITS"].get(ext, app.config["UPLOAD_MAX_FILE_SIZE"])
+
+
+class UploadSpool:
+    """File container Werkzeug streams multipart uploads into.
+
+    Chunks go straight to a temp file next to UPLOAD_FOLDER (so the final
+    move is an atomic rename) while being hashed, size-checked against the
+    per-type limit and sniffed for the image signature.  Once a check fails
+    the rest of the upload is discarded instead of written, and `error`
+    holds the message save_uploaded_image() reports.
+    """
+
+    def __init__(self, filename):
+        self.ext = get_file_extension(filename or "")
+        self.limit = upload_size_limit(self.ext)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.error = None
+        self._head = b""
+        self._sniffed = False
+        self.path = None
+        self._fh = None  # created on first write; empty file inputs never touch disk
+
+    def _open(self):
+        tmp_dir = os.path.join(app.config["UPLOAD_FOLDER"], ".tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="upload-", suffix=".part", dir=tmp_dir)
+        self._fh = os.fdopen(fd, "w+b")
+
+    def _check_head(self):
+        self._sniffed = True
+        if not sniff_image_type(self._head, self.ext):
+            self._reject(
+                f"File contents do not look like a .{self.ext} image. "
+                "Please upload a valid image file."
+            )
+
+    def _reject(self, message):
+        self.error = message
+        self.close()
+
+    def write(self, data):
+        if self.error:
+            return len(data)  # drain the rest of the part without storing it
+        self.size += len(data)
+        if self.size > self.limit:
+            self._reject(
+                f"File is too large. Maximum for .{self.ext} files is "
+                f"{self.limit / 1048576:.1f} MB."
+            )
+            return len(data)
+        if not self._sniffed:
+            self._head += data[: SNIFF_BYTES - len(self._head)]
+            if len(self._head) >= SNIFF_BYTES:
+                self._check_head()
+                if self.error:
+                    return len(data)
+        if self._fh is None:
+            self._open()
+        self.sha256.update(data)
+        self._fh.write(data)
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        # Werkzeug rewinds once the part is complete: finish small files' sniff.
+        if not self._sniffed and not self.error and self.size:
+            self._check_head()
+        return 0 if self.closed else self._fh.seek(offset, whence)
+
+    def read(self, size=-1):
+        return b"" if self.closed else self._fh.read(size)
+
+    def tell(self):
+        return 0 if self.closed else self._fh.tell()
+
+    def flush(self):
+        if not self.closed:
+            self._fh.flush()
+
+    def move_to(self, dest):
+        """Atomically move the spooled file to `dest`."""
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._fh.close()
+        os.replace(self.path, dest)
+        self.path = None
+
+    def close(self):
+        if self._fh and not self._fh.closed:
+            self._fh.close()
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    @property
+    def closed(self):
+        return self._fh is None or self._fh.closed
+
+
+class UploadRequest(Request):
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return UploadSpool(filename)
+
+
+app.request_class = UploadRequest
+
+
+def hash_upload_stream(stream):
+    """Return (sha256 hexdigest, size) of a file stream, then rewind it."""
+    digest = hashlib.sha256()
+    size = 0
+    chunk_size = app.config.get("UPLOAD_CHUNK_SIZE", 64 * 1024)
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+
+# Uploads live under two levels of hex prefixes (`portfolio/3f/a2/<name>`) so
+# no single directory grows past a few hundred files.  The shard is derived
+# from the file name alone: content-hashed names use their own leading hex
+# digits, legacy names the sha256 of their stem.  Variants strip their
+# `-480w` suffix first, so they always land beside their source.
+UPLOAD_SHARD_LEVELS = 2
+_VARIANT_SUFFIX_RE = re.compile(r"-\d+w$")
+_HASHED_STEM_RE = re.compile(r"^[0-9a-f]{%d}$" % UPLOAD_HASH_LENGTH)
+FLAT_UPLOAD_URL_RE = re.compile(r"^/static/uploads/([^/.][^/]*)/([^/]+)$")
+
+
+def upload_shard(filename):
+    """Return the `ab/cd` shard directory for an upload file name."""
+    stem = _VARIANT_SUFFIX_RE.sub("", os.path.splitext(filename)[0])
+    if not _HASHED_STEM_RE.match(stem):
+        stem = hashlib.sha256(stem.encode("utf-8")).hexdigest()
+    return "/".join(stem[i * 2 : i * 2 + 2] for i in range(UPLOAD_SHARD_LEVELS))
+
+
+def sharded_upload_url(url):
+    """Map a flat `/static/uploads/<subdir>/<name>` URL to its sharded form.
+
+    Returns None for URLs that are not flat upload URLs.
+    """
+    match = FLAT_UPLOAD_URL_RE.match(url or "")
+    if not match:
+        return None
+    subdir, name = match.groups()
+    return f"/static/uploads/{subdir}/{upload_shard(name)}/{name}"
+
+
+def save_uploaded_image(file, subdir):
+    """Save an uploaded image file and return its web-accessible URL.
+
+    Files are stored content-addressed as `<subdir>/<ab>/<cd>/<sha256[:32]>.<ext>`,
+    so uploading the same image twice reuses the existing file and its URL
+    can be cached forever.  The UploadBlob row for new content is flushed
+    straight away, so call this before staging other changes; the caller's
+    commit persists it and should then pass the URL to
+    enqueue_image_processing().
+
+    Returns a tuple (url, error_message).  On success error_message is None.
+    On failure url is None and error_message explains the problem.
+    """
+    # Guard: no file or empty filename
+    if not file or not file.filename or file.filename.strip() == "":
+        return None, None  # nothing submitted — not an error
+
+    original = file.filename.strip()
+    ext = get_file_extension(original)
+
+    if not ext:
+        return None, "File has no extension. Please upload an image file."
+
+    if ext not in app.config["ALLOWED_EXTENSIONS"]:
+        allowed = ", ".join(sorted(app.config["ALLOWED_EXTENSIONS"]))
+        return None, f"File type '.{ext}' is not supported. Allowed: {allowed}"
+
+    spool = file.stream if isinstance(file.stream, UploadSpool) else None
+    try:
+        if spool is not None:
+            # Already hashed and checked while the request body streamed in
+            if spool.error:
+                return None, spool.error
+            sha256, size = spool.sha256.hexdigest(), spool.size
+        else:
+            head = file.stream.read(SNIFF_BYTES)
+            file.stream.seek(0)
+            if not sniff_image_type(head, ext):
+                return None, (
+                    f"File contents do not look like a .{ext} image. "
+                    "Please upload a valid image file."
+                )
+            sha256, size = hash_upload_stream(file.stream)
+            if size > upload_size_limit(ext):
+                return None, (
+                    f"File is too large. Maximum for .{ext} files is "
+                    f"{upload_size_limit(ext) / 1048576:.1f} MB."
+                )
+        name = f"{sha256[:UPLOAD_HASH_LENGTH]}.{ext}"
+        shard = upload_shard(name)
+        upload_dir = os.path.join(app.config["UPLOAD_FOLDER"], subdir, *shard.split("/"))
+        filepath = os.path.join(upload_dir, name)
+        url = f"/static/uploads/{subdir}/{shard}/{name}"
+
+        blob = UploadBlob.query.filter_by(url=url).first()
+        if blob is not None and os.path.exists(filepath):
+            app.logger.info("Duplicate upload, reusing %s", url)
+            return url, None
+
+        os.makedirs(upload_dir, exist_ok=True)
+        if spool is not None:
+            spool.move_to(filepath)
+        else:
+            tmp_path = filepath + ".part"
+            file.save(tmp_path)
+            os.replace(tmp_path, filepath)
+        if blob is None:
+            db.session.add(
+                UploadBlob(
+                    sha256=sha256,
+                    url=url,
+                    size=size,
+                    original_name=secure_filename(original)[:255] or None,
+                )
+            )
+            try:
+                db.session.flush()
+            except IntegrityError:
+                # A concurrent upload of the same content inserted the row
+                # first; the file on disk is identical, so just reuse it.
+                db.session.rollback()
+                app.logger.info("Concurrent upload, reusing %s", url)
+        app.logger.info("Image saved: %s", url)
+        return url, None
+    except OSError as e:
+        app.logger.error("File upload failed: %s", e, exc_info=True)
+        return None, f"Server error saving file: {e}"
+
+
+def _blob_for_url(url):
+    """Find the UploadBlob for an upload URL, registering legacy files lazily."""
+    blob = UploadBlob.query.filter_by(url=url).first()
+    if blob is not None:
+        return blob
+    path = static_url_to_path(url)
+    if not url.startswith("/static/uploads/") or not path or not os.path.isfile(path):
+        return None
+    with open(path, "rb") as fh:
+        sha256, size = hash_upload_stream(fh)
+    blob = UploadBlob(sha256=sha256, url=url, size=size, original_name=os.path.basename(path))
+    db.session.add(blob)
+    return blob
+
+
+def sync_upload_reference(owner):
+    """Point owner's UploadReference at the blob for its current image_url.
+
+    Keeps UploadBlob.ref_count in step; call after the owner has an id
+    (flush first for new rows) and before committing.
+    """
+    ref = UploadReference.query.filter_by(
+        owner_type=owner.__tablename__, owner_id=owner.id
+    ).first()
+    blob = _blob_for_url(owner.image_url) if owner.image_url else None
+    if ref is not None and blob is not None and ref.blob_id == blob.id:
+        return
+
+    if ref is not None:
+        ref.blob.ref_count = max(0, (ref.blob.ref_count or 0) - 1)
+        if blob is None:
+            db.session.delete(ref)
+    if blob is not None:
+        blob.ref_count = (blob.ref_count or 0) + 1
+        if ref is None:
+            ref = UploadReference(owner_type=owner.__tablename__, owner_id=owner.id)
+            db.session.add(ref)
+        ref.blob = blob
+
+
+def release_upload_reference(owner):
+    """Drop owner's UploadReference (use when deleting the owner row)."""
+    ref = UploadReference.query.filter_by(
+        owner_type=owner.__tablename__, owner_id=owner.id
+    ).first()
+    if ref is not None:
+        ref.blob.ref_count = max(0, (ref.blob.ref_count or 0) - 1)
+        db.session.delete(ref)
+
+
+def backfill_upload_references():
+    """Create references for rows whose uploads predate UploadReference."""
+    created = 0
+    for model in (Portfolio, Advertisement):
+        referenced = db.select(UploadReference.owner_id).where(
+            UploadReference.owner_type == model.__tablename__
+        )
+        rows = model.query.filter(
+            model.image_url.like("/static/uploads/%"), model.id.notin_(referenced)
+        ).all()
+        for row in rows:
+            sync_upload_reference(row)
+            created += 1
+    if created:
+        db.session.commit()
+    return created
+
+
+# --- Upload image pipeline ---------------------------------------------------
+# After an upload is saved, a background thread writes optimized siblings
+# next to it: a full-size WebP (what responsive_picture looks for), optional
+# AVIF, and downscaled copies for each IMAGE_VARIANT_WIDTHS entry.  Every
+# file is recorded as an ImageVariant row, and templates read them through
+# image_variant_index without touching the database.
+PROCESSABLE_IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "webp", "bmp", "tif", "tiff", "gif", "avif"}
+IMAGE_SAVE_OPTIONS = {
+    "webp": lambda cfg: {"format": "WEBP", "quality": cfg["IMAGE_WEBP_QUALITY"], "method": 6},
+    "avif": lambda cfg: {"format": "AVIF", "quality": cfg["IMAGE_AVIF_QUALITY"]},
+}
+_image_executor = None
+_image_jobs_pending = set()
+_image_jobs_lock = threading.Lock()
+IMAGE_BACKFILL_LOCK = "thuwala-image-backfill.lock"
+
+
+def static_url_to_path(url):
+    """Map a /static/... URL to a filesystem path, or None for other URLs."""
+    if not url or not url.startswith("/static/") or ".." in url:
+        return None
+    rel = url.split("?", 1)[0][len("/static/") :]
+    if rel.startswith("uploads/"):
+        return os.path.join(app.config["UPLOAD_FOLDER"], rel[len("uploads/") :])
+    return os.path.join(app.static_folder, rel)
+
+
+def _image_output_formats():
+    formats = [f for f in app.config["IMAGE_VARIANT_FORMATS"] if f in IMAGE_SAVE_OPTIONS]
+    if "avif" in formats and not _pillow_supports("AVIF"):
+        formats.remove("avif")
+    return formats
+
+
+def _pillow_supports(fmt):
+    Image.init()
+    return fmt in Image.SAVE
+
+
+def _save_atomic(img, path, **options):
+    # A private temp name per call: another worker may be writing the same
+    # variant at the same moment.  Not dot-prefixed, so the upload GC
+    # removes one left behind by a crash once it is past the grace period.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix="tmp-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            img.save(fh, **options)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it owner-only
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return os.path.getsize(path)
+
+
+def generate_image_variants(source_url):
+    """Write the optimized copies of one image and describe them.
+
+    Returns a list of dicts (url, format, width, height, bytes).  The source
+    itself is included as the 'original' variant at its intrinsic size.
+    """
+    path = static_url_to_path(source_url)
+    ext = get_file_extension(path or "")
+    if Image is None or not path or ext not in PROCESSABLE_IMAGE_EXTENSIONS:
+        return []
+
+    base_path, _ = os.path.splitext(path)
+    base_url, _ = os.path.splitext(source_url)
+    variants = []
+
+    with Image.open(path) as img:
+        if getattr(img, "is_animated", False):
+            return []  # keep animations as uploaded
+        img = ImageOps.exif_transpose(img)
+        width, height = img.size
+        variants.append(
+            {
+                "url": source_url,
+                "format": "original",
+                "width": width,
+                "height": height,
+                "bytes": os.path.getsize(path),
+            }
+        )
+        has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+        img = img.convert("RGBA" if has_alpha else "RGB")
+
+        targets = [w for w in app.config["IMAGE_VARIANT_WIDTHS"] if w < width]
+        for target in targets + [width]:
+            if target == width:
+                frame, suffix = img, ""
+            else:
+                frame = img.resize(
+                    (target, max(1, round(height * target / width))),
+                    Image.LANCZOS,
+                )
+                suffix = f"-{target}w"
+
+            for fmt in _image_output_formats():
+                if not suffix and ext == fmt:
+                    continue  # the upload already is a full-size copy
+                out_path = f"{base_path}{suffix}.{fmt}"
+                size = _save_atomic(
+                    frame, out_path, **IMAGE_SAVE_OPTIONS[fmt](app.config)
+                )
+                variants.append(
+                    {
+                        "url": f"{base_url}{suffix}.{fmt}",
+                        "format": fmt,
+                        "width": frame.width,
+                        "height": frame.height,
+                        "bytes": size,
+                    }
+                )
+
+            if suffix:
+                # Downscaled copy in the source format for the <img> fallback
+                out_path = f"{base_path}{suffix}.{ext}"
+                fallback, options = frame, {}
+                if ext in ("jpg", "jpeg"):
+                    fallback = frame.convert("RGB")
+                    options = {"quality": 85, "optimize": True}
+                size = _save_atomic(
+                    fallback,
+                    out_path,
+                    format=Image.registered_extensions()[f".{ext}"],
+                    **options,
+                )
+                variants.append(
+                    {
+                        "url": f"{base_url}{suffix}.{ext}",
+                        "format": "original",
+                        "width": frame.width,
+                        "height": frame.height,
+                        "bytes": size,
+                    }
+                )
+    return variants
+
+
+def record_image_variants(source_url, variants):
+    """Replace the stored ImageVariant rows for one source image."""
+    ImageVariant.query.filter_by(source_url=source_url).delete()
+    for variant in variants:
+        db.session.add(ImageVariant(source_url=source_url, **variant))
+    db.session.commit()
+    image_variant_index.put(source_url, variants)
+
+
+def process_uploaded_image(source_url):
+    """Generate and record variants for one image (runs in the pipeline thread)."""
+    with app.app_context():
+        try:
+            started = time.monotonic()
+            variants = generate_image_variants(source_url)
+            if variants:
+                record_image_variants(source_url, variants)
+                app.logger.info(
+                    "Processed %s into %d variants in %.0f ms",
+                    source_url,
+                    len(variants),
+                    (time.monotonic() - started) * 1000,
+                )
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error("Image processing failed for %s: %s", source_url, e, exc_info=True)
+        finally:
+            with _image_jobs_lock:
+                _image_jobs_pending.discard(source_url)
+
+
+def enqueue_image_processing(source_url):
+    """Schedule variant generation for an uploaded image.
+
+    IMAGE_PROCESSING selects 'async' (background thread, the default),
+    'sync' (inline, e.g. on serverless hosts that freeze threads) or 'off'.
+    """
+    global _image_executor
+    mode = app.config.get("IMAGE_PROCESSING", "async")
+    if mode == "off" or Image is None:
+        return
+    with _image_jobs_lock:
+        if source_url in _image_jobs_pending:
+            return
+        _image_jobs_pending.add(source_url)
+    if mode == "sync":
+        process_uploaded_image(source_url)
+        return
+    if _image_executor is None:
+        _image_executor = ThreadPoolExecutor(
+            max_workers=app.config.get("IMAGE_WORKERS", 2),
+            thread_name_prefix="image-pipeline",
+        )
+    _image_executor.submit(process_uploaded_image, source_url)
+
+
+# Size, dominant color and LQIP (low-quality image placeholder) of the image
+# a Portfolio / Advertisement row shows; see ImageMetadataMixin.
+IMAGE_METADATA_FIELDS = ("image_width", "image_height", "image_color", "image_placeholder")
+PLACEHOLDER_SIZE = 16
+
+
+def compute_image_metadata(path):
+    """Return {image_width, image_height, image_color, image_placeholder}."""
+    with Image.open(path) as img:
+        width, height = img.size
+        if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):  # rotated by EXIF
+            width, height = height, width
+        img.draft("RGB", (PLACEHOLDER_SIZE * 8, PLACEHOLDER_SIZE * 8))  # fast JPEG decode
+        thumb = ImageOps.exif_transpose(img)
+        if thumb.mode in ("RGBA", "LA", "P"):
+            thumb = thumb.convert("RGBA")
+            background = Image.new("RGBA", thumb.size, (255, 255, 255, 255))
+            thumb = Image.alpha_composite(background, thumb)
+        thumb = thumb.convert("RGB")
+        thumb.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+
+    quantized = thumb.quantize(colors=5)
+    _, index = max(quantized.getcolors())
+    red, green, blue = quantized.getpalette()[index * 3 : index * 3 + 3]
+
+    buffer = io.BytesIO()
+    fmt = "WEBP" if _pillow_supports("WEBP") else "PNG"
+    thumb.save(buffer, fmt, quality=40)
+    encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+    return {
+        "image_width": width,
+        "image_height": height,
+        "image_color": f"#{red:02x}{green:02x}{blue:02x}",
+        "image_placeholder": f"data:image/{fmt.lower()};base64,{encoded}",
+    }
+
+
+def apply_image_metadata(owner, force=False):
+    """Fill owner's image metadata for its current image_url.
+
+    Copies from another row showing the same image when possible; otherwise
+    decodes a small draft of the file.  Call before the owner is flushed
+    (or after, for new rows) and before committing.
+    """
+    changed = inspect(owner).attrs.image_url.history.has_changes()
+    if not force and not changed and owner.image_width is not None:
+        return
+    for field in IMAGE_METADATA_FIELDS:
+        setattr(owner, field, None)
+    url = owner.image_url
+    if not url:
+        return
+    with db.session.no_autoflush:
+        for model in (Portfolio, Advertisement):
+            query = model.query.filter(
+                model.image_url == url, model.image_width.isnot(None)
+            )
+            if isinstance(owner, model) and owner.id is not None:
+                query = query.filter(model.id != owner.id)
+            donor = query.first()
+            if donor is not None:
+                for field in IMAGE_METADATA_FIELDS:
+                    setattr(owner, field, getattr(donor, field))
+                return
+    path = static_url_to_path(url)
+    if Image is None or not path or not os.path.isfile(path):
+        return  # external or missing images keep the generic placeholder
+    try:
+        for field, value in compute_image_metadata(path).items():
+            setattr(owner, field, value)
+    except Exception as e:
+        app.logger.warning("Could not read image metadata for %s: %s", url, e)
+
+
+def backfill_image_metadata(force=False, batch_size=100):
+    """Compute image metadata for rows that lack it; returns rows updated."""
+    updated = 0
+    for model in (Portfolio, Advertisement):
+        query = model.query.filter(model.image_url.isnot(None))
+        if not force:
+            query = query.filter(model.image_width.is_(None))
+        for row in query.all():
+            apply_image_metadata(row, force=True)
+            if row.image_width is not None:
+                updated += 1
+                if updated % batch_size == 0:
+                    db.session.commit()
+    db.session.commit()
+    return updated
+
+
+def claim_image_backfill():
+    """True if this process should run the variant backfill.
+
+    Every gunicorn worker runs init_db, so the first one to create the lock
+    file (holding its pid) does the backfill; the claim passes to a new
+    worker once that process has exited.
+    """
+    path = os.path.join(tempfile.gettempdir(), IMAGE_BACKFILL_LOCK)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            try:
+                with open(path, encoding="ascii") as fh:
+                    owner = int(fh.read().strip() or 0)
+                age = time.time() - os.path.getmtime(path)
+            except (OSError, ValueError):
+                owner, age = 0, 0
+            if owner == os.getpid():
+                return True
+            if (owner and _pid_alive(owner)) or (not owner and age < 60):
+                return False  # held, or being written by a worker starting now
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        with os.fdopen(fd, "w", encoding="ascii") as fh:
+            fh.write(str(os.getpid()))
+        return True
+    return False
+
+
+def enqueue_missing_image_variants():
+    """Queue uploads that have no variants yet (e.g. the worker died mid-job)."""
+    if not claim_image_backfill():
+        return 0
+    processed = db.select(ImageVariant.source_url).distinct()
+    queued = 0
+    for model in (Portfolio, Advertisement):
+        rows = (
+            db.session.query(model.image_url)
+            .filter(
+                model.image_url.like("/static/uploads/%"),
+                model.image_url.notin_(processed),
+            )
+            .distinct()
+        )
+        for (url,) in rows:
+            enqueue_image_processing(url)
+            queued += 1
+    return queued
+
+
+# --- Upload garbage collection ------------------------------------------------
+# Replacing or deleting an image leaves the old file behind.  The collector
+# gathers every URL still in use (image_url columns plus the variants derived
+# from them) in one pass, walks UPLOAD_FOLDER with os.scandir, and deletes or
+# quarantines unreferenced files older than UPLOAD_GC_GRACE_SECONDS.  The
+# grace period protects uploads whose row has not been committed yet.
+UPLOAD_QUARANTINE_DIR = ".quarantine"
+UPLOAD_TMP_DIR = ".tmp"
+_upload_gc_thread = None
+
+
+def referenced_upload_urls():
+    """Return the set of /static/uploads/ URLs still used by any row."""
+    image_urls = db.union(
+        db.select(Portfolio.image_url), db.select(Advertisement.image_url)
+    )
+    referenced = {url for url in db.session.execute(image_urls).scalars() if url}
+    for source_url, url in db.session.query(ImageVariant.source_url, ImageVariant.url):
+        if source_url in referenced:
+            referenced.add(url)
+    return {url for url in referenced if url.startswith("/static/uploads/")}
+
+
+def _walk_upload_files(root, rel=""):
+    """Yield (relative path, os.DirEntry) for every file under root."""
+    with os.scandir(os.path.join(root, rel)) as entries:
+        for entry in entries:
+            entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                yield from _walk_upload_files(root, entry_rel)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry_rel, entry
+
+
+def collect_upload_garbage(dry_run=False, quarantine=None, grace_seconds=None):
+    """Remove unreferenced uploads and report disk usage per subdirectory.
+
+    Returns a dict: {"subdirs": {name: {"files", "bytes", "orphans",
+    "orphan_bytes", "removed"}}, "removed": [...], "dry_run": bool}.
+    """
+    root = app.config["UPLOAD_FOLDER"]
+    if quarantine is None:
+        quarantine = app.config.get("UPLOAD_GC_QUARANTINE", False)
+    if grace_seconds is None:
+        grace_seconds = app.config.get("UPLOAD_GC_GRACE_SECONDS", 86400)
+    cutoff = time.time() - grace_seconds
+    referenced = referenced_upload_urls()
+    quarantine_root = os.path.join(
+        root, UPLOAD_QUARANTINE_DIR, datetime.utcnow().strftime("%Y%m%d")
+    )
+
+    report = {"subdirs": {}, "removed": [], "dry_run": dry_run}
+    if not os.path.isdir(root):
+        return report
+
+    for rel, entry in _walk_upload_files(root):
+        top = rel.split("/", 1)[0] if "/" in rel else "."
+        stats = report["subdirs"].setdefault(
+            top, {"files": 0, "bytes": 0, "orphans": 0, "orphan_bytes": 0, "removed": 0}
+        )
+        st = entry.stat(follow_symlinks=False)
+        stats["files"] += 1
+        stats["bytes"] += st.st_size
+
+        if top == UPLOAD_QUARANTINE_DIR or entry.name.startswith("."):
+            continue  # quarantined files and .gitkeep are reported, never collected
+        url = f"/static/uploads/{rel}"
+        # Partial writes (the .tmp dir, or a *.tmp left by _save_atomic)
+        # are deleted outright, never quarantined
+        scratch = top == UPLOAD_TMP_DIR or entry.name.endswith(".tmp")
+        if not scratch and url in referenced:
+            continue
+        stats["orphans"] += 1
+        stats["orphan_bytes"] += st.st_size
+        if st.st_mtime > cutoff:
+            continue  # too new: may belong to a request still in flight
+
+        report["removed"].append(url)
+        stats["removed"] += 1
+        if dry_run:
+            continue
+        try:
+            if quarantine and not scratch:
+                dest = os.path.join(quarantine_root, rel)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(entry.path, dest)
+            else:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass  # another worker got there first
+
+    if report["removed"] and not dry_run:
+        removed = report["removed"]
+        for start in range(0, len(removed), 500):
+            batch = removed[start : start + 500]
+            ImageVariant.query.filter(ImageVariant.url.in_(batch)).delete(
+                synchronize_session=False
+            )
+            UploadBlob.query.filter(
+                UploadBlob.url.in_(batch), UploadBlob.ref_count <= 0
+            ).delete(synchronize_session=False)
+        db.session.commit()
+        app.logger.info("Upload GC removed %d files", len(removed))
+    return report
+
+
+def start_upload_gc_timer():
+    """Run collect_upload_garbage() every UPLOAD_GC_INTERVAL seconds (0 = off)."""
+    global _upload_gc_thread
+    interval = app.config.get("UPLOAD_GC_INTERVAL", 0)
+    if interval <= 0 or _upload_gc_thread is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    collect_upload_garbage()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error("Upload GC failed: %s", e, exc_info=True)
+
+    _upload_gc_thread = threading.Thread(target=run, name="upload-gc", daemon=True)
+    _upload_gc_thread.start()
+
+
+# --- Sharded upload migration --------------------------------------------------
+# Columns holding upload URLs, rewritten when flat files move into shards.
+UPLOAD_URL_COLUMNS = (
+    (Portfolio, "image_url"),
+    (Advertisement, "image_url"),
+    (UploadBlob, "url"),
+    (ImageVariant, "url"),
+    (ImageVariant, "source_url"),
+)
+
+
+def shard_existing_uploads(dry_run=False, batch_size=500):
+    """Move flat `<subdir>/<name>` uploads into shards and rewrite their URLs.
+
+    Files are moved first and the URL columns rewritten afterwards in batched
+    executemany UPDATEs.  Rows are rewritten whenever the sharded file exists,
+    so re-running after an interruption finishes the job; until then the old
+    URLs keep working through redirect_legacy_upload().
+
+    Returns {"moved": int, "rewritten": {"table.column": int}, "dry_run": bool}.
+    """
+    root = app.config["UPLOAD_FOLDER"]
+    report = {"moved": 0, "rewritten": {}, "dry_run": dry_run}
+    moved = set()
+    if os.path.isdir(root):
+        for subdir in sorted(os.scandir(root), key=lambda e: e.name):
+            if subdir.name.startswith(".") or not subdir.is_dir(follow_symlinks=False):
+                continue  # .tmp / .quarantine stay flat
+            with os.scandir(subdir.path) as entries:
+                files = [e for e in entries if e.is_file(follow_symlinks=False)]
+            for entry in files:
+                if entry.name.startswith("."):
+                    continue
+                new_url = sharded_upload_url(f"/static/uploads/{subdir.name}/{entry.name}")
+                dest = static_url_to_path(new_url)
+                if not dry_run:
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    os.replace(entry.path, dest)
+                moved.add(new_url)
+                report["moved"] += 1
+
+    for model, attr in UPLOAD_URL_COLUMNS:
+        column = getattr(model, attr)
+        pairs = []
+        for url in db.session.execute(db.select(column).distinct()).scalars():
+            new_url = sharded_upload_url(url)
+            if new_url and (new_url in moved or os.path.isfile(static_url_to_path(new_url))):
+                pairs.append({"old_url": url, "new_url": new_url})
+        report["rewritten"][f"{model.__tablename__}.{attr}"] = len(pairs)
+        if dry_run:
+            continue
+        table = model.__table__
+        stmt = (
+            db.update(table)
+            .where(table.c[attr] == db.bindparam("old_url"))
+            .values({attr: db.bindparam("new_url")})
+        )
+        for start in range(0, len(pairs), batch_size):
+            db.session.execute(stmt, pairs[start : start + batch_size])
+            db.session.commit()
+
+    if not dry_run:
+        image_variant_index.invalidate()
+    return report
+
+
+@app.errorhandler(404)
+def redirect_legacy_upload(e):
+    """Send requests for pre-sharding upload URLs to the file's new home."""
+    new_url = sharded_upload_url(request.path)
+    if new_url and os.path.isfile(static_url_to_path(new_url)):
+        return redirect(new_url, code=301)
+    return e
+
+
+STATIC_PROBE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+STATIC_PROBE_SKIP_DIRS = ("uploads", "critical")
+
+
+class ImageVariantIndex:
+    """Per-worker view of every known image variant, keyed by source URL.
+
+    Uploads come from ImageVariant rows; images shipped under static/ come
+    from the manifest scripts/generate_webp.py writes, or from the .webp /
+    .avif files committed next to them when no build has made one.  Each entry maps a
+    format to a ready-made `srcset` string, plus the intrinsic width and
+    height, so templates do no string building or filesystem checks per
+    render.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = None
+        self._loaded_at = 0.0
+
+    @staticmethod
+    def _entry(variants):
+        entry = {}
+        largest = max(
+            (v for v in variants if v.get("width") and v.get("height")),
+            key=lambda v: v["width"],
+            default=None,
+        )
+        if largest:
+            entry["width"], entry["height"] = largest["width"], largest["height"]
+        for fmt in ("avif", "webp", "original"):
+            candidates = sorted(
+                (v for v in variants if v["format"] == fmt and v.get("width")),
+                key=lambda v: v["width"],
+            )
+            if candidates:
+                entry[fmt] = ", ".join(f"{v['url']} {v['width']}w" for v in candidates)
+            elif fmt != "original":
+                # A probed sibling of unknown size: a single-candidate srcset
+                sibling = next((v for v in variants if v["format"] == fmt), None)
+                if sibling:
+                    entry[fmt] = sibling["url"]
+        return entry
+
+    @staticmethod
+    def _load_static():
+        """Group the static image manifest like ImageVariant rows."""
+        path = os.path.join(app.static_folder, app.config["IMAGE_MANIFEST"])
+        try:
+            with open(path, encoding="utf-8") as fh:
+                images = json.load(fh).get("images", {})
+        except FileNotFoundError:
+            return ImageVariantIndex._probe_static()
+        except (OSError, ValueError, AttributeError) as e:
+            app.logger.warning("Could not read image manifest %s: %s", path, e)
+            return {}
+
+        def url(rel):
+            return f"{app.static_url_path}/{quote(asset_manifest.lookup(rel))}"
+
+        grouped = {}
+        for rel, image in images.items():
+            variants = [
+                {
+                    "url": url(rel),
+                    "format": "original",
+                    "width": image.get("width"),
+                    "height": image.get("height"),
+                }
+            ]
+            variants.extend(
+                {
+                    "url": url(output["path"]),
+                    "format": output["format"],
+                    "width": output["width"],
+                    "height": output["height"],
+                }
+                for output in image.get("outputs", [])
+            )
+            grouped[f"{app.static_url_path}/{rel}"] = variants
+        return grouped
+
+    @staticmethod
+    def _probe_static():
+        """Without a manifest (no build step ran), find committed .webp/.avif
+        siblings of the static images by looking next to each one."""
+        grouped = {}
+        for dirpath, dirnames, filenames in os.walk(app.static_folder):
+            if os.path.samefile(dirpath, app.static_folder):
+                dirnames[:] = [d for d in dirnames if d not in STATIC_PROBE_SKIP_DIRS]
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            names = set(filenames)
+            for name in filenames:
+                stem, ext = os.path.splitext(name)
+                if ext.lower() not in STATIC_PROBE_EXTENSIONS:
+                    continue
+                siblings = [
+                    (fmt, f"{stem}.{fmt}") for fmt in ("avif", "webp") if f"{stem}.{fmt}" in names
+                ]
+                if not siblings:
+                    continue
+                rel = os.path.relpath(os.path.join(dirpath, name), app.static_folder)
+                rel_dir = os.path.dirname(rel.replace(os.sep, "/"))
+                variants = []
+                for fmt, sibling in siblings:
+                    sibling_rel = f"{rel_dir}/{sibling}" if rel_dir else sibling
+                    variants.append(
+                        {
+                            "url": f"{app.static_url_path}/{quote(asset_manifest.lookup(sibling_rel))}",
+                            "format": fmt,
+                            "width": None,
+                            "height": None,
+                        }
+                    )
+                grouped[f"{app.static_url_path}/{rel.replace(os.sep, '/')}"] = variants
+        return grouped
+
+    def _load(self):
+        grouped = self._load_static()
+        for row in ImageVariant.query.all():
+            grouped.setdefault(row.source_url, []).append(
+                {
+                    "url": row.url,
+                    "format": row.format,
+                    "width": row.width,
+                    "height": row.height,
+                }
+            )
+        return {url: self._entry(variants) for url, variants in grouped.items()}
+
+    def get(self, source_url):
+        """Return {'avif'|'webp'|'original': srcset, 'width', 'height'} or None."""
+        ttl = app.config.get("IMAGE_VARIANT_TTL", 300)
+        with self._lock:
+            if self._entries is None or time.monotonic() - self._loaded_at > ttl:
+                try:
+                    self._entries = self._load()
+                except Exception as e:
+                    app.logger.warning("Could not load image variants: %s", e)
+                    db.session.rollback()
+                    self._entries = self._entries or {}
+                self._loaded_at = time.monotonic()
+            return self._entries.get(source_url)
+
+    def put(self, source_url, variants):
+        with self._lock:
+            if self._entries is not None:
+                self._entries[source_url] = self._entry(variants)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+
+
+image_variant_index = ImageVariantIndex()
+
+
+@app.template_global()
+def image_variants(source_url):
+    return image_variant_index.get(source_url) if source_url else None
+
+
+# --- Outbound email queue ---------------------------------------------------------
+# Requests never talk to SMTP.  queue_email() only adds an OutboundEmail row
+# to the caller's transaction; deliver_pending_emails() later sends the due
+# rows over one authenticated connection that is reused across messages, and
+# retries failures with exponential backoff up to MAIL_MAX_ATTEMPTS.
+#
+# MAIL_DELIVERY picks who runs delivery: 'thread' (a background thread per
+# worker, woken after each enqueue), 'sync' (right after the request commits,
+# for hosts that freeze threads) or 'external' (scripts/send_mail.py only).
+MAIL_CLAIM_SECONDS = 300  # a crashed sender's claimed rows become due again after this
+_mail_wakeup = threading.Event()
+_mail_thread = None
+_mail_thread_lock = threading.Lock()
+
+
+class SMTPTransport:
+    """One authenticated SMTP connection, reused across messages.
+
+    It is dropped after MAIL_CONNECTION_IDLE seconds without use and
+    reopened once when the server has closed it in the meantime.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._server = None
+        self._last_used = 0.0
+
+    def _connect(self):
+        cfg = self.config
+        server = smtplib.SMTP(
+            cfg["MAIL_SERVER"], cfg["MAIL_PORT"], timeout=cfg.get("MAIL_TIMEOUT", 20)
+        )
+        try:
+            if cfg.get("MAIL_USE_TLS", True):
+                server.starttls()
+            if cfg.get("MAIL_USERNAME"):
+                server.login(cfg["MAIL_USERNAME"], cfg["MAIL_PASSWORD"])
+        except Exception:
+            server.close()
+            raise
+        return server
+
+    def send(self, message):
+        self.close_if_idle()
+        for attempt in (1, 2):
+            if self._server is None:
+                self._server = self._connect()
+            try:
+                self._server.send_message(message)
+                break
+            except smtplib.SMTPServerDisconnected:
+                self._server = None
+                if attempt == 2:
+                    raise
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        idle = self.config.get("MAIL_CONNECTION_IDLE", 60)
+        if self._server is not None and time.monotonic() - self._last_used > idle:
+            self.close()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+
+def mail_credentials_missing():
+    """True when SMTP credentials are absent and we are in development.
+
+    Development keeps the old shortcut of printing the message (its
+    plain-text body, with any links) instead of sending it; production retries (and eventually fails) so an operator
+    notices the missing MAIL_USERNAME / MAIL_PASSWORD.
+    """
+    if app.config.get("MAIL_USERNAME") and app.config.get("MAIL_PASSWORD"):
+        return False
+    return app.debug or os.environ.get("FLASK_ENV", "").lower() == "development"
+
+
+def queue_email(to_address, subject, text_body, html_body=None):
+    """Add a message to the outbox in the current transaction.
+
+    Commit, then call wake_mail_delivery().
+    """
+    email = OutboundEmail(
+        to_address=to_address,
+        subject=subject,
+        text_body=text_body,
+        html_body=html_body,
+    )
+    db.session.add(email)
+    return email
 
-class PasswordResetToken(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
-    token = db.Column(db.String(100), unique=True, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at = db.Column(db.DateTime, nullable=False)
-    is_used = db.Column(db.Boolean, default=False)
 
-    user = db.relationship("User", backref="reset_tokens")
+def build_email_message(email):
+    if email.html_body:
+        message = MIMEMultipart("alternative")
+        message.attach(MIMEText(email.text_body, "plain"))
+        message.attach(MIMEText(email.html_body, "html"))
+    else:
+        message = MIMEText(email.text_body, "plain")
+    message["Subject"] = email.subject
+    message["From"] = app.config["MAIL_DEFAULT_SENDER"]
+    message["To"] = email.to_address
+    return message
 
 
-class Advertisement(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text)
-    cta_text = db.Column(db.String(100), default="Learn More")
-    cta_link = db.Column(db.String(500))
-    image_url = db.Column(db.String(500))
-    background_color = db.Column(db.String(50), default="#2563eb")
-    text_color = db.Column(db.String(50), default="#ffffff")
-    is_active = db.Column(db.Boolean, default=True)
-    start_date = db.Column(db.DateTime, default=datetime.utcnow)
-    end_date = db.Column(db.DateTime)
-    display_order = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+def claim_due_emails(limit):
+    """Mark up to limit due rows as 'sending' and return them.
 
+    Each claim is a conditional UPDATE, so concurrent senders (threads in
+    several workers, the CLI) never pick up the same row.
+    """
+    now = datetime.utcnow()
+    lease = now + timedelta(seconds=MAIL_CLAIM_SECONDS)
+    candidates = db.session.execute(
+        db.select(OutboundEmail.id, OutboundEmail.status, OutboundEmail.next_attempt_at)
+        .where(
+            OutboundEmail.status.in_(("pending", "sending")),
+            OutboundEmail.next_attempt_at <= now,
+        )
+        .order_by(OutboundEmail.next_attempt_at)
+        .limit(limit)
+    ).all()
+    claimed = []
+    for email_id, status, due in candidates:
+        result = db.session.execute(
+            db.update(OutboundEmail)
+            .where(
+                OutboundEmail.id == email_id,
+                OutboundEmail.status == status,
+                OutboundEmail.next_attempt_at == due,
+            )
+            .values(status="sending", next_attempt_at=lease)
+        )
+        if result.rowcount == 1:
+            claimed.append(email_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return OutboundEmail.query.filter(OutboundEmail.id.in_(claimed)).all()
+
+
+def retry_delay(attempts):
+    """Seconds before the next try: doubling from MAIL_RETRY_BASE, +-20% jitter."""
+    delay = min(
+        app.config["MAIL_RETRY_BASE"] * 2 ** (attempts - 1), app.config["MAIL_RETRY_MAX"]
+    )
+    return delay * random.uniform(0.8, 1.2)
 
-# --- Lazy DB initialization (essential for Vercel / serverless) ----------
-# On Vercel the `if __name__ == '__main__'` block never executes, so
-# `init_db()` would never be called.  We use a `before_request` hook
-# to create tables and seed data on the very first request of each
-# cold-start.
-_db_initialized = False
+
+def deliver_email(email, transport):
+    """Send one claimed row and record the outcome; returns the new status."""
+    email.attempts += 1
+    try:
+        if mail_credentials_missing():
+            # Print the plain-text body so links in it (e.g. password
+            # resets) can be followed locally
+            print(
+                "DEBUG: Email credentials not configured. "
+                f"Would send {email.subject!r} to {email.to_address}:\n{email.text_body}"
+            )
+        else:
+            transport.send(build_email_message(email))
+    except Exception as e:
+        email.last_error = f"{type(e).__name__}: {e}"[:1000]
+        permanent = isinstance(e, smtplib.SMTPRecipientsRefused)
+        if permanent or email.attempts >= app.config["MAIL_MAX_ATTEMPTS"]:
+            email.status = "failed"
+            app.logger.error(
+                "Giving up on email %s to %s after %d attempts: %s",
+                email.id, email.to_address, email.attempts, e,
+            )
+        else:
+            email.status = "pending"
+            email.next_attempt_at = datetime.utcnow() + timedelta(
+                seconds=retry_delay(email.attempts)
+            )
+            app.logger.warning(
+                "Email %s to %s failed (attempt %d), retrying at %s: %s",
+                email.id, email.to_address, email.attempts, email.next_attempt_at, e,
+            )
+    else:
+        email.status = "sent"
+        email.sent_at = datetime.utcnow()
+        email.last_error = None
+    db.session.commit()
+    return email.status
 
 
-@app.before_request
-def ensure_db_initialized():
-    global _db_initialized
-    if not _db_initialized:
+def deliver_pending_emails(transport=None, limit=None):
+    """Send every due outbox row; returns {'sent': n, 'pending': n, 'failed': n}.
+
+    Pass a long-lived transport to keep the SMTP connection across calls;
+    without one a connection is opened for this call and closed at the end.
+    """
+    own_transport = transport is None
+    if own_transport:
+        transport = SMTPTransport(app.config)
+    limit = limit or app.config["MAIL_BATCH_SIZE"]
+    counts = {"sent": 0, "pending": 0, "failed": 0}
+    try:
+        while True:
+            batch = claim_due_emails(limit)
+            for email in batch:
+                counts[deliver_email(email, transport)] += 1
+            if len(batch) < limit:
+                break
+    finally:
+        if own_transport:
+            transport.close()
+    return counts
+
+
+def start_mail_worker():
+    """Start this worker's delivery thread (MAIL_DELIVERY='thread')."""
+    global _mail_thread
+    if app.config.get("MAIL_DELIVERY", "thread") != "thread":
+        return
+    with _mail_thread_lock:
+        if _mail_thread is not None:
+            return
+
+        def run():
+            transport = SMTPTransport(app.config)
+            while True:
+                with app.app_context():
+                    try:
+                        deliver_pending_emails(transport)
+                    except Exception as e:
+                        db.session.rollback()
+                        app.logger.error("Email delivery failed: %s", e, exc_info=True)
+                _mail_wakeup.wait(app.config.get("MAIL_POLL_INTERVAL", 30))
+                _mail_wakeup.clear()
+                transport.close_if_idle()
+
+        _mail_thread = threading.Thread(target=run, name="mail-delivery", daemon=True)
+        _mail_thread.start()
+
+
+def wake_mail_delivery():
+    """Deliver newly committed outbox rows according to MAIL_DELIVERY."""
+    mode = app.config.get("MAIL_DELIVERY", "thread")
+    if mode == "sync":
         try:
-            db.create_all()
-            init_db()
+            deliver_pending_emails()
         except Exception as e:
-            app.logger.warning("Lazy DB init failed: %s", e)
-        _db_initialized = True
+            db.session.rollback()
+            app.logger.error("Email delivery failed: %s", e, exc_info=True)
+    elif mode == "thread":
+        start_mail_worker()
+        _mail_wakeup.set()
+
+
+# --- Contact message digests ------------------------------------------------------
+# New ContactMessages are announced in digests rather than one email each.
+# contact() only arms a per-worker timer (schedule_contact_digest); when it
+# fires, every message not yet announced is claimed and sent as one email
+# through the outbox (CONTACT_DIGEST_EMAIL) and/or one JSON POST
+# (CONTACT_DIGEST_WEBHOOK).  N messages inside one CONTACT_DIGEST_WINDOW cost
+# one notification, not N.
+CONTACT_DIGEST_LIST_LIMIT = 50  # messages spelled out per digest; the rest are counted
+_contact_digest_timer = None
+_contact_digest_lock = threading.Lock()
+
+
+def contact_digest_enabled():
+    return app.config.get("CONTACT_DIGEST_WINDOW", 0) > 0 and bool(
+        app.config.get("CONTACT_DIGEST_EMAIL") or app.config.get("CONTACT_DIGEST_WEBHOOK")
+    )
 
 
-@login_manager.user_loader
-def load_user(user_id):
+def schedule_contact_digest():
+    """Arm the digest timer unless one is already pending; cheap enough per message."""
+    global _contact_digest_timer
+    if not contact_digest_enabled():
+        return
+    with _contact_digest_lock:
+        if _contact_digest_timer is not None:
+            return
+        _contact_digest_timer = threading.Timer(
+            app.config["CONTACT_DIGEST_WINDOW"], _run_contact_digest
+        )
+        _contact_digest_timer.daemon = True
+        _contact_digest_timer.start()
+
+
+def _run_contact_digest():
+    global _contact_digest_timer
+    with _contact_digest_lock:
+        _contact_digest_timer = None  # messages arriving from now on arm the next one
+    with app.app_context():
+        try:
+            flush_contact_digest()
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error("Contact digest failed, retrying next window: %s", e)
+            schedule_contact_digest()
+
+
+def format_contact_digest(messages):
+    """Return (subject, text) for a digest email."""
+    count = len(messages)
+    lines = [f"{count} new contact message{'s' if count != 1 else ''}:", ""]
+    for message in messages[:CONTACT_DIGEST_LIST_LIMIT]:
+        sender = f"{message.name} <{message.email}>"
+        if message.phone:
+            sender += f", {message.phone}"
+        received = message.created_at.strftime("%Y-%m-%d %H:%M UTC") if message.created_at else ""
+        lines += [
+            f"From: {sender}",
+            f"Subject: {message.subject or '(none)'}",
+            f"Received: {received}",
+            "",
+            message.message[:1000],
+            "",
+            "-" * 40,
+        ]
+    if count > CONTACT_DIGEST_LIST_LIMIT:
+        lines.append(f"...and {count - CONTACT_DIGEST_LIST_LIMIT} more.")
+    lines.append("Read and reply from the admin dashboard.")
+    subject = f"{count} new contact message{'s' if count != 1 else ''} - Thuwala Co."
+    return subject, "\n".join(lines)
+
+
+def post_contact_digest_webhook(messages):
+    """POST the digest as JSON; the `text` field suits chat incoming webhooks."""
+    subject, text = format_contact_digest(messages)
+    payload = {
+        "text": subject,
+        "count": len(messages),
+        "messages": [
+            {
+                "id": m.id,
+                "name": m.name,
+                "email": m.email,
+                "phone": m.phone,
+                "subject": m.subject,
+                "message": m.message,
+                "created_at": m.created_at.isoformat() if m.created_at else None,
+            }
+            for m in messages[:CONTACT_DIGEST_LIST_LIMIT]
+        ],
+    }
+    webhook = urllib.request.Request(
+        app.config["CONTACT_DIGEST_WEBHOOK"],
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    with urllib.request.urlopen(webhook, timeout=app.config.get("MAIL_TIMEOUT", 20)) as response:
+        response.read()
+
+
+def flush_contact_digest():
+    """Announce every not-yet-notified ContactMessage in one digest.
+
+    Rows are claimed by stamping notified_at first, so digests from several
+    workers never repeat a message.  If sending fails the claim is released
+    and the messages go out with the next digest.  Returns the message count.
+    """
+    stamp = datetime.utcnow()
+    db.session.execute(
+        db.update(ContactMessage)
+        .where(ContactMessage.notified_at.is_(None))
+        .values(notified_at=stamp)
+    )
+    db.session.commit()
+    messages = (
+        ContactMessage.query.filter_by(notified_at=stamp).order_by(ContactMessage.id).all()
+    )
+    if not messages:
+        return 0
     try:
-        return User.query.get(int(user_id))
+        if app.config.get("CONTACT_DIGEST_EMAIL"):
+            subject, text_body = format_contact_digest(messages)
+            queue_email(app.config["CONTACT_DIGEST_EMAIL"], subject, text_body)
+        if app.config.get("CONTACT_DIGEST_WEBHOOK"):
+            post_contact_digest_webhook(messages)
+        db.session.commit()
     except Exception:
-        return None
+        db.session.rollback()
+        db.session.execute(
+            db.update(ContactMessage)
+            .where(ContactMessage.notified_at == stamp)
+            .values(notified_at=None)
+        )
+        db.session.commit()
+        raise
+    wake_mail_delivery()
+    app.logger.info("Sent contact digest of %d messages", len(messages))
+    return len(messages)
+
+
+# --- Contact ingestion journal --------------------------------------------------
+# With CONTACT_INGESTION='journal', contact() appends each submission as one
+# JSON line to this process's journal file (active-<pid>.jsonl) and returns;
+# nothing waits on the database write lock.  A background flusher rotates the
+# file every CONTACT_FLUSH_INTERVAL_MS into batch-<pid>-<n>.jsonl and inserts
+# all pending batches into ContactMessage with one executemany and one
+# commit, then deletes them.  If that insert fails, the rows are retried one
+# at a time and any the database rejects as invalid (too long, constraint
+# violations) go to dead-letter.jsonl, so one bad submission cannot hold up
+# the rest.  Files left by a process that died (its pid is gone) are adopted
+# and replayed by the next flusher, so a crash loses nothing; a crash between
+# the commit and the delete can replay a batch twice (delivery is
+# at-least-once).
+CONTACT_JOURNAL_FIELDS = ("name", "email", "phone", "subject", "message", "created_at")
+CONTACT_JOURNAL_RE = re.compile(r"^(?:active|batch)-(\d+)(?:-\d+)?\.jsonl$")
+CONTACT_DEAD_LETTER = "dead-letter.jsonl"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
 
 
-def generate_reset_token():
-    """Generate a secure reset token"""
-    return secrets.token_urlsafe(32)
+class ContactJournal:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        self._thread = None
 
+    @property
+    def directory(self):
+        return app.config.get("CONTACT_JOURNAL_DIR") or os.path.join(
+            app.instance_path, "contact-journal"
+        )
 
-def get_file_extension(filename):
-    """Extract lowercase file extension from a filename."""
-    if not filename or "." not in filename:
-        return ""
-    return filename.rsplit(".", 1)[1].lower()
+    def _active_path(self):
+        return os.path.join(self.directory, f"active-{os.getpid()}.jsonl")
+
+    def append(self, fields):
+        """Durably record one submission; the flusher inserts it shortly after."""
+        line = (json.dumps(fields, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():  # first use, or forked
+                os.makedirs(self.directory, exist_ok=True)
+                self._fd = os.open(
+                    self._active_path(), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600
+                )
+                self._pid = os.getpid()
+            os.write(self._fd, line)
+            if app.config.get("CONTACT_JOURNAL_FSYNC", True):
+                os.fsync(self._fd)
+        self.start()
+
+    def _rotate(self):
+        """Move appends so far into a batch file; new appends reopen the active file."""
+        with self._lock:
+            if self._fd is None or self._pid != os.getpid():
+                return
+            if os.fstat(self._fd).st_size:
+                os.close(self._fd)
+                self._fd = None
+                os.replace(self._active_path(), self._batch_path())
+
+    def _batch_path(self):
+        return os.path.join(self.directory, f"batch-{os.getpid()}-{time.time_ns()}.jsonl")
+
+    def _pending_batches(self):
+        """This process's batch files, after adopting those of dead processes."""
+        try:
+            names = sorted(os.listdir(self.directory))
+        except FileNotFoundError:
+            return []
+        own, pid = [], os.getpid()
+        for name in names:
+            match = CONTACT_JOURNAL_RE.match(name)
+            if not match:
+                continue
+            path = os.path.join(self.directory, name)
+            owner = int(match.group(1))
+            if owner == pid:
+                if name.startswith("batch-"):
+                    own.append(path)
+            elif not _pid_alive(owner):
+                adopted = self._batch_path()
+                try:
+                    os.rename(path, adopted)  # atomic: one live process wins
+                except FileNotFoundError:
+                    continue
+                own.append(adopted)
+        return own
+
+    @staticmethod
+    def _read(path):
+        rows = []
+        with open(path, encoding="utf-8") as fh:
+            for number, line in enumerate(fh, 1):
+                try:
+                    entry = json.loads(line)
+                    row = {key: entry.get(key) or "" for key in CONTACT_JOURNAL_FIELDS}
+                    row["created_at"] = datetime.fromisoformat(entry["created_at"])
+                except (ValueError, KeyError, TypeError) as e:
+                    # a torn last line from a crash mid-append
+                    app.logger.warning("Skipping bad journal line %s:%d: %s", path, number, e)
+                    continue
+                rows.append(row)
+        return rows
+
+    def flush(self):
+        """Insert every pending submission; returns the number of rows written."""
+        self._rotate()
+        batches = self._pending_batches()
+        if not batches:
+            return 0
+        rows = [row for path in batches for row in self._read(path)]
+        if rows:
+            try:
+                db.session.execute(db.insert(ContactMessage), rows)
+                db.session.commit()
+            except StatementError as e:
+                db.session.rollback()
+                if not self._is_bad_row(e):
+                    raise  # e.g. the database is down: keep the batches for the next tick
+                app.logger.warning("Contact journal batch rejected, inserting rows singly: %s", e)
+                rows = self._insert_singly(rows)
+        for path in batches:
+            os.remove(path)
+        if rows:
+            schedule_contact_digest()
+        return len(rows)
+
+    @staticmethod
+    def _is_bad_row(error):
+        """True for errors caused by the data rather than the database."""
+        if isinstance(error, (DataError, IntegrityError)):
+            return True
+        return isinstance(error, StatementError) and not isinstance(error, DBAPIError)
 
+    def _insert_singly(self, rows):
+        """Insert rows one by one, dead-lettering the rejected ones; returns those inserted."""
+        inserted = []
+        for row in rows:
+            try:
+                db.session.execute(db.insert(ContactMessage), [row])
+                db.session.commit()
+            except StatementError as e:
+                db.session.rollback()
+                if not self._is_bad_row(e):
+                    raise
+                self._dead_letter(row, e)
+            else:
+                inserted.append(row)
+        return inserted
+
+    def _dead_letter(self, row, error):
+        path = os.path.join(self.directory, CONTACT_DEAD_LETTER)
+        entry = dict(row, error=f"{type(error).__name__}: {error.orig or error}"[:1000])
+        with open(path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(entry, default=str, ensure_ascii=False) + "\n")
+        app.logger.error(
+            "Contact message from %s could not be stored; moved to %s", row["email"], path
+        )
 
-def is_allowed_file(filename):
-    """Check if uploaded file has an allowed extension."""
-    return get_file_extension(filename) in app.config["ALLOWED_EXTENSIONS"]
+    def _flush_in_context(self):
+        with app.app_context():
+            try:
+                self.flush()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error("Contact journal flush failed: %s", e, exc_info=True)
+
+    def start(self):
+        """Start this process's flusher thread (idempotent)."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+
+            def run():
+                interval = app.config.get("CONTACT_FLUSH_INTERVAL_MS", 250) / 1000
+                while True:
+                    time.sleep(interval)
+                    self._flush_in_context()
+
+            self._thread = threading.Thread(target=run, name="contact-journal", daemon=True)
+            self._thread.start()
+            atexit.register(self._flush_in_context)
+
+    def recover(self):
+        """Start flushing if journal files exist (e.g. left by a crashed worker)."""
+        try:
+            if any(CONTACT_JOURNAL_RE.match(n) for n in os.listdir(self.directory)):
+                self.start()
+        except FileNotFoundError:
+            pass
+
+
+contact_journal = ContactJournal()
+
+
+# --- Rate limiting ------------------------------------------------------------------
+# POSTs to the login, password reset and contact forms are limited per client
+# IP and, where a username/email is submitted, per account, so a bot cannot
+# tie up the workers with password checks or flood the message table.
+#
+# RATE_LIMITS maps "<endpoint>" (per IP) and "<endpoint>:user" (per account)
+# to "<algorithm>:<limit>/<seconds>".  'bucket' is a token bucket (bursts of
+# <limit>, refilled evenly over <seconds>); 'window' is a sliding window
+# counter (the previous fixed window weighted by its overlap plus the
+# current one).  Both keep three numbers per key, so a check is O(1).
+#
+# The login's account rule counts per IP and username, so guessing from one
+# address is slowed without letting anyone lock the admin out from
+# elsewhere; password reset counts per email from any address, to protect
+# the inbox it sends to.
+#
+# State lives in RATE_LIMIT_STORAGE: 'sqlite' (a file in the temp dir shared
+# by the workers on this host, the default), 'sqlite:///<path>', 'memory'
+# (this worker only) or 'redis://...' (anything speaking the Redis protocol,
+# needs the redis package).  Storage errors let requests through.
+RATE_LIMIT_RULE_RE = re.compile(r"^(bucket|window):(\d+)/(\d+)$")
+RATE_LIMIT_MEMORY_KEYS = 10000
+RATE_LIMIT_RECENT_REJECTIONS = 50
+
+
+def token_bucket(state, now, limit, period):
+    """Return (new state, seconds to wait or 0).  State: (tokens, updated_at, 0)."""
+    rate = limit / period
+    tokens, updated_at, _ = state or (limit, now, 0)
+    tokens = min(limit, tokens + (now - updated_at) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now, 0), 0
+    return (tokens, now, 0), (1 - tokens) / rate
+
+
+def sliding_window(state, now, limit, period):
+    """Return (new state, seconds to wait or 0).  State: (window_start, current, previous)."""
+    start = now - now % period
+    window_start, current, previous = state or (start, 0, 0)
+    if window_start != start:
+        previous = current if start - window_start == period else 0
+        current = 0
+    weight = 1 - (now - start) / period
+    if previous * weight + current < limit:
+        return (start, current + 1, previous), 0
+    if current < limit:
+        # wait until the previous window's share has shrunk enough
+        retry_after = start + period * (1 - (limit - current) / previous) - now
+    else:
+        retry_after = start + period - now + period * (1 - limit / current)
+    return (start, current, previous), retry_after
+
+
+RATE_LIMIT_ALGORITHMS = {"bucket": token_bucket, "window": sliding_window}
+
+
+class MemoryRateLimitStorage:
+    """Per-worker state in a bounded LRU dict."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def update(self, key, fn, ttl):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            state = entry[0] if entry and entry[1] > now else None
+            new_state, result = fn(state)
+            self._entries[key] = (new_state, now + ttl)
+            while len(self._entries) > RATE_LIMIT_MEMORY_KEYS:
+                self._entries.popitem(last=False)
+        return result
+
+
+class SQLiteRateLimitStorage:
+    """State in a SQLite file shared by every worker on the host.
+
+    Each update is one BEGIN IMMEDIATE transaction, so concurrent workers
+    serialize on the key's read-modify-write.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limit "
+                "(key TEXT PRIMARY KEY, a REAL, b REAL, c REAL, expires REAL)"
+            )
+            self._local.conn = conn
+        return conn
 
+    def update(self, key, fn, ttl):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT a, b, c, expires FROM rate_limit WHERE key = ?", (key,)
+            ).fetchone()
+            state = row[:3] if row and row[3] > now else None
+            new_state, result = fn(state)
+            conn.execute(
+                "INSERT INTO rate_limit (key, a, b, c, expires) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET a = excluded.a, b = excluded.b, "
+                "c = excluded.c, expires = excluded.expires",
+                (key, *new_state, now + ttl),
+            )
+            if random.random() < 0.001:
+                conn.execute("DELETE FROM rate_limit WHERE expires < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
 
-def has_uploaded_file(field_name):
-    """Check if a real file was submitted in the given form field."""
-    if field_name not in request.files:
-        return False
-    f = request.files[field_name]
-    return f and f.filename and f.filename.strip() != ""
 
+class RedisRateLimitStorage:
+    """State in Redis (or a Redis-protocol server), updated with WATCH/MULTI."""
 
-def save_uploaded_image(file, subdir, add_timestamp=True):
-    """Save an uploaded image file and return its web-accessible URL.
+    def __init__(self, url):
+        self._client = redis.Redis.from_url(url, socket_timeout=1)
 
-    Returns a tuple (url, error_message).  On success error_message is None.
-    On failure url is None and error_message explains the problem.
+    def update(self, key, fn, ttl):
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    raw = pipe.get(key)
+                    state = tuple(float(v) for v in raw.split(b":")) if raw else None
+                    new_state, result = fn(state)
+                    pipe.multi()
+                    value = ":".join(repr(float(v)) for v in new_state)
+                    pipe.set(key, value, px=int(ttl * 1000))
+                    pipe.execute()
+                    return result
+                except redis.WatchError:
+                    continue  # another worker changed the key; redo with its state
+
+
+def make_rate_limit_storage(spec):
+    if spec == "memory":
+        return MemoryRateLimitStorage()
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        if redis is not None:
+            return RedisRateLimitStorage(spec)
+        app.logger.warning("RATE_LIMIT_STORAGE is Redis but redis is not installed; using SQLite")
+        spec = "sqlite"
+    if spec.startswith("sqlite:///"):
+        return SQLiteRateLimitStorage(spec[len("sqlite:///") :])
+    return SQLiteRateLimitStorage(os.path.join(tempfile.gettempdir(), "thuwala-rate-limits.db"))
+
+
+class RateLimiter:
+    """Applies RATE_LIMITS and counts what it lets through and rejects.
+
+    The counters are per worker; /admin/rate-limits shows them.
     """
-    # Guard: no file or empty filename
-    if not file or not file.filename or file.filename.strip() == "":
-        return None, None  # nothing submitted — not an error
 
-    original = file.filename.strip()
-    ext = get_file_extension(original)
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._storage = None
+        self._rules = {}
+        self.counts = {}
+        self.recent_rejections = deque(maxlen=RATE_LIMIT_RECENT_REJECTIONS)
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            with self._lock:
+                if self._storage is None:
+                    self._storage = make_rate_limit_storage(app.config["RATE_LIMIT_STORAGE"])
+        return self._storage
+
+    def rule(self, name):
+        spec = app.config.get("RATE_LIMITS", {}).get(name)
+        if not spec:
+            return None
+        if spec not in self._rules:
+            match = RATE_LIMIT_RULE_RE.match(spec.strip())
+            if not match:
+                app.logger.warning("Ignoring malformed rate limit %s = %r", name, spec)
+            self._rules[spec] = match and (
+                RATE_LIMIT_ALGORITHMS[match.group(1)], int(match.group(2)), int(match.group(3))
+            )
+        return self._rules[spec]
+
+    def hit(self, name, identity):
+        """Count one request against rule `name`; return seconds to wait (0 = allowed)."""
+        rule = self.rule(name)
+        if rule is None or not identity:
+            return 0
+        algorithm, limit, period = rule
+        try:
+            retry_after = self.storage.update(
+                f"rl:{name}:{identity}",
+                lambda state: algorithm(state, time.time(), limit, period),
+                ttl=2 * period,
+            )
+        except Exception as e:
+            app.logger.warning("Rate limit storage failed, allowing request: %s", e)
+            retry_after = 0
+        with self._lock:
+            counts = self.counts.setdefault(name, {"allowed": 0, "rejected": 0})
+            counts["rejected" if retry_after else "allowed"] += 1
+            if retry_after:
+                self.recent_rejections.append(
+                    {"at": datetime.utcnow().isoformat(), "rule": name, "key": identity}
+                )
+        return retry_after
 
-    if not ext:
-        return None, "File has no extension. Please upload an image file."
+    def check(self, endpoint, ip, user=None, user_per_ip=False):
+        """Apply the per-IP rule, then the per-account one; returns seconds to wait.
 
-    if ext not in app.config["ALLOWED_EXTENSIONS"]:
-        allowed = ", ".join(sorted(app.config["ALLOWED_EXTENSIONS"]))
-        return None, f"File type '.{ext}' is not supported. Allowed: {allowed}"
+        With user_per_ip the account rule counts each (IP, account) pair
+        separately, so nobody can lock an account out for everyone else.
+        """
+        retry_after = self.hit(endpoint, ip)
+        if not retry_after and user:
+            identity = user.strip().lower()
+            if user_per_ip:
+                identity = f"{ip}|{identity}"
+            retry_after = self.hit(f"{endpoint}:user", identity)
+        if retry_after:
+            app.logger.warning(
+                "Rate limited %s from %s%s", endpoint, ip, f" ({user})" if user else ""
+            )
+        return math.ceil(retry_after)
 
-    # Build a safe filename, preserving the extension even if secure_filename strips it
-    safe_name = secure_filename(original)
-    if not safe_name or not get_file_extension(safe_name):
-        # secure_filename stripped too much — rebuild from timestamp + extension
-        safe_name = f"upload.{ext}"
 
-    if add_timestamp:
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        safe_name = f"{timestamp}_{safe_name}"
+rate_limiter = RateLimiter()
 
-    upload_dir = os.path.join(app.config["UPLOAD_FOLDER"], subdir)
-    try:
-        os.makedirs(upload_dir, exist_ok=True)
-        filepath = os.path.join(upload_dir, safe_name)
-        file.save(filepath)
-        url = f"/static/uploads/{subdir}/{safe_name}"
-        app.logger.info("Image saved: %s", url)
-        return url, None
-    except OSError as e:
-        app.logger.error("File upload failed: %s", e, exc_info=True)
-        return None, f"Server error saving file: {e}"
 
+def client_ip():
+    """The client address, trusting RATE_LIMIT_TRUSTED_PROXIES X-Forwarded-For hops."""
+    hops = app.config.get("RATE_LIMIT_TRUSTED_PROXIES", 0)
+    forwarded = [ip.strip() for ip in request.headers.get("X-Forwarded-For", "").split(",")]
+    if hops and len(forwarded) >= hops and forwarded[-hops]:
+        return forwarded[-hops]
+    return request.remote_addr or "unknown"
 
-def send_password_reset_email(user_email, reset_url):
-    """Send password reset email to user"""
-    # If mail credentials are not configured, behave differently in dev vs production.
-    missing_creds = not app.config.get("MAIL_USERNAME") or not app.config.get(
-        "MAIL_PASSWORD"
-    )
 
-    if missing_creds:
-        msg = f"Email credentials not configured. Would send reset link to {user_email}: {reset_url}"
-        print(f"DEBUG: {msg}")
-        # In debug/development keep the previous shortcut behavior to avoid blocking local dev.
-        # In production fail loudly so an operator notices and fixes mail settings.
-        is_dev = app.debug or os.environ.get("FLASK_ENV", "").lower() == "development"
-        if is_dev:
-            return True
-        raise RuntimeError(
-            "MAIL_USERNAME and MAIL_PASSWORD must be set in production to send emails"
-        )
+def rate_limited(template, user_field=None, user_per_ip=False):
+    """Limit POSTs to a form view; over the limit it re-renders the form with a 429.
 
-    try:
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = "Password Reset Request - Thuwala Co."
-        msg["From"] = app.config["MAIL_DEFAULT_SENDER"]
-        msg["To"] = user_email
-
-        # HTML email content
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Password Reset - Thuwala Co.</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .header {{ background: linear-gradient(135deg, #2563eb, #1d4ed8); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
-                .content {{ background: #f9fafb; padding: 30px; border-radius: 0 0 10px 10px; }}
-                .button {{ display: inline-block; background: #2563eb; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; font-weight: bold; }}
-                .footer {{ margin-top: 30px; padding-top: 20px; border-top: 1px solid #e5e7eb; color: #6b7280; font-size: 14px; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Thuwala Co.</h1>
-                    <p>Password Reset Request</p>
-                </div>
-                <div class="content">
-                    <h2>Hello,</h2>
-                    <p>We received a request to reset your password for the Thuwala Co. admin account.</p>
-                    <p>Click the button below to reset your password:</p>
-                    <p style="text-align: center; margin: 30px 0;">
-                        <a href="{reset_url}" class="button">Reset Password</a>
-                    </p>
-                    <p>Or copy and paste this link into your browser:</p>
-                    <p style="background: #f3f4f6; padding: 15px; border-radius: 5px; word-break: break-all;">
-                        {reset_url}
-                    </p>
-                    <p>This link will expire in 24 hours.</p>
-                    <p>If you didn't request a password reset, you can safely ignore this email.</p>
-                    <div class="footer">
-                        <p>Best regards,<br>The Thuwala Co. Team</p>
-                        <p style="font-size: 12px; color: #9ca3af;">
-                            This is an automated message. Please do not reply to this email.
-                        </p>
-                    </div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+    user_field names the form field that identifies the account (username
+    or email) for the "<endpoint>:user" rule; user_per_ip keys that rule on
+    the client IP and account together (see RateLimiter.check).
+    """
 
-        # Plain text version
-        text = f"""
-        Password Reset Request - Thuwala Co.
-        
-        Hello,
-        
-        We received a request to reset your password for the Thuwala Co. admin account.
-        
-        Click this link to reset your password: {reset_url}
-        
-        This link will expire in 24 hours.
-        
-        If you didn't request a password reset, you can safely ignore this email.
-        
-        Best regards,
-        The Thuwala Co. Team
-        """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method == "POST" and app.config.get("RATE_LIMIT_ENABLED", True):
+                user = request.form.get(user_field) if user_field else None
+                retry_after = rate_limiter.check(request.endpoint, client_ip(), user, user_per_ip)
+                if retry_after:
+                    minutes = max(1, math.ceil(retry_after / 60))
+                    flash(
+                        f"Too many attempts. Please try again in {minutes} "
+                        f"minute{'s' if minutes != 1 else ''}.",
+                        "error",
+                    )
+                    response = app.make_response((render_template(template), 429))
+                    response.headers["Retry-After"] = str(retry_after)
+                    return response
+            return view(*args, **kwargs)
+
+        return wrapped
+
+    return decorator
+
+
+# --- Contact spam filter ------------------------------------------------------------
+# Runs ahead of the rate limiter on POST /contact, so junk costs one HMAC and
+# a dict lookup: no rate limit write, no database row, no WhatsApp link.
+# Forms posting to /contact include contact_form_fields(): a honeypot input
+# people never see (bots fill every field) and a signed timestamp of when the
+# form was rendered.  A submission is dropped for one of FILTER_REASONS:
+#
+#   honeypot   the hidden field has a value
+#   bad_token  the timestamp signature does not verify
+#   no_token   the form has no timestamp (e.g. a page cached before a deploy)
+#   expired    the form is older than CONTACT_FORM_MAX_AGE
+#   too_fast   sent sooner than CONTACT_MIN_SUBMIT_SECONDS after rendering
+#   duplicate  the same email and message was stored within CONTACT_DEDUPE_SECONDS
+#
+# Bots get the usual thank-you; people who may be real (no_token, expired)
+# are asked to send the message again.  Messages are remembered once they
+# have been stored, per worker, as sha256 digests in an LRU of
+# CONTACT_DEDUPE_SIZE entries.  With WhatsApp enabled a duplicate is not
+# stored again but still redirected, since the first hand-off may not have
+# opened.
+CONTACT_HONEYPOT_FIELD = "website"
+CONTACT_TOKEN_FIELD = "form_ts"
+CONTACT_FILTER_REASONS = ("honeypot", "bad_token", "no_token", "expired", "too_fast", "duplicate")
+CONTACT_RESEND_REASONS = ("no_token", "expired")
+
+
+class ContactFilter:
+    """Checks contact form posts and counts why they were dropped.
+
+    The counters are per worker; /admin/rate-limits shows them.
+    """
 
-        # Attach both versions
-        part1 = MIMEText(text, "plain")
-        part2 = MIMEText(html, "html")
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signer = None
+        self._recent = OrderedDict()
+        self.counts = dict.fromkeys(("accepted",) + CONTACT_FILTER_REASONS, 0)
+
+    @property
+    def signer(self):
+        if self._signer is None:
+            self._signer = TimestampSigner(app.secret_key, salt="contact-form")
+        return self._signer
+
+    def token(self):
+        return self.signer.sign("contact").decode()
+
+    @staticmethod
+    def digest(email, message):
+        normalized = " ".join(message.lower().split())
+        return hashlib.sha256(f"{email.strip().lower()}\0{normalized}".encode()).digest()
+
+    def is_duplicate(self, email, message):
+        """True if this email and message were stored within CONTACT_DEDUPE_SECONDS."""
+        key = self.digest(email, message)
+        with self._lock:
+            seen_at = self._recent.get(key)
+        return seen_at is not None and (
+            time.monotonic() - seen_at < app.config["CONTACT_DEDUPE_SECONDS"]
+        )
 
-        msg.attach(part1)
-        msg.attach(part2)
+    def remember(self, email, message):
+        """Record a message once it has been stored.
 
-        # Send email
-        with smtplib.SMTP(app.config["MAIL_SERVER"], app.config["MAIL_PORT"]) as server:
-            if app.config.get("MAIL_USE_TLS", True):
-                server.starttls()
-            server.login(app.config["MAIL_USERNAME"], app.config["MAIL_PASSWORD"])
-            server.send_message(msg)
+        Only stored messages count, so a sender who was rate limited or hit
+        a database error can send the same text again.
+        """
+        key = self.digest(email, message)
+        with self._lock:
+            self._recent.pop(key, None)
+            self._recent[key] = time.monotonic()
+            while len(self._recent) > app.config["CONTACT_DEDUPE_SIZE"]:
+                self._recent.popitem(last=False)
+
+    def reason(self, form):
+        """Why this submission should be dropped, or None to accept it."""
+        if form.get(CONTACT_HONEYPOT_FIELD):
+            return "honeypot"
+        token = form.get(CONTACT_TOKEN_FIELD)
+        if not token:
+            return "no_token"
+        try:
+            _, rendered_at = self.signer.unsign(
+                token, max_age=app.config["CONTACT_FORM_MAX_AGE"], return_timestamp=True
+            )
+        except SignatureExpired:
+            return "expired"
+        except BadSignature:
+            return "bad_token"
+        if time.time() - rendered_at.timestamp() < app.config["CONTACT_MIN_SUBMIT_SECONDS"]:
+            return "too_fast"
+        if self.is_duplicate(form.get("email", ""), form.get("message", "")):
+            return "duplicate"
+        return None
 
-        print(f"Password reset email sent to {user_email}")
-        return True
+    def check(self, form):
+        reason = self.reason(form)
+        with self._lock:
+            self.counts[reason or "accepted"] += 1
+        return reason
+
+
+contact_filter = ContactFilter()
+
+
+@app.template_global()
+def contact_form_fields():
+    """Hidden honeypot and signed timestamp inputs for forms posting to /contact."""
+    return Markup(
+        '<input type="hidden" name="{}" value="{}">'
+        '<div style="position:absolute;left:-10000px" aria-hidden="true">'
+        '<label>Website <input type="text" name="{}" value="" tabindex="-1" '
+        'autocomplete="off"></label></div>'
+    ).format(CONTACT_TOKEN_FIELD, contact_filter.token(), CONTACT_HONEYPOT_FIELD)
+
+
+def contact_filtered(view):
+    """Drop spam and duplicate posts to the contact view before it runs."""
+
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if request.method == "POST" and app.config.get("CONTACT_FILTER_ENABLED", True):
+            reason = contact_filter.check(request.form)
+            if reason == "duplicate" and app.config.get("WHATSAPP_ENABLED"):
+                # Opening WhatsApp may have failed the first time; hand the
+                # message over again without storing a second copy
+                g.contact_duplicate = True
+                reason = None
+            if reason in CONTACT_RESEND_REASONS:
+                flash("This form has expired. Please send your message again.", "error")
+                return redirect(url_for("contact"))
+            if reason:
+                app.logger.info("Dropped contact form post (%s) from %s", reason, client_ip())
+                flash("Thank you for your message! We will contact you soon.", "success")
+                return redirect(url_for("contact"))
+        return view(*args, **kwargs)
+
+    return wrapped
+
+
+def queue_password_reset_email(user_email, reset_url):
+    """Add the password reset email to the outbox; the caller commits."""
+    # HTML email content
+    html = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <title>Password Reset - Thuwala Co.</title>
+        <style>
+            body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+            .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+            .header {{ background: linear-gradient(135deg, #2563eb, #1d4ed8); color: white; padding: 30px; text-align: center; border-radius: 10px 10px 0 0; }}
+            .content {{ background: #f9fafb; padding: 30px; border-radius: 0 0 10px 10px; }}
+            .button {{ display: inline-block; background: #2563eb; color: white; padding: 12px 30px; text-decoration: none; border-radius: 5px; font-weight: bold; }}
+            .footer {{ margin-top: 30px; padding-top: 20px; border-top: 1px solid #e5e7eb; color: #6b7280; font-size: 14px; }}
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1>Thuwala Co.</h1>
+                <p>Password Reset Request</p>
+            </div>
+            <div class="content">
+                <h2>Hello,</h2>
+                <p>We received a request to reset your password for the Thuwala Co. admin account.</p>
+                <p>Click the button below to reset your password:</p>
+                <p style="text-align: center; margin: 30px 0;">
+                    <a href="{reset_url}" class="button">Reset Password</a>
+                </p>
+                <p>Or copy and paste this link into your browser:</p>
+                <p style="background: #f3f4f6; padding: 15px; border-radius: 5px; word-break: break-all;">
+                    {reset_url}
+                </p>
+                <p>This link will expire in 24 hours.</p>
+                <p>If you didn't request a password reset, you can safely ignore this email.</p>
+                <div class="footer">
+                    <p>Best regards,<br>The Thuwala Co. Team</p>
+                    <p style="font-size: 12px; color: #9ca3af;">
+                        This is an automated message. Please do not reply to this email.
+                    </p>
+                </div>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
 
-    except Exception as e:
-        app.logger.error("Error sending email: %s", e, exc_info=True)
-        return False
+    # Plain text version
+    text = f"""
+    Password Reset Request - Thuwala Co.
+    
+    Hello,
+    
+    We received a request to reset your password for the Thuwala Co. admin account.
+    
+    Click this link to reset your password: {reset_url}
+    
+    This link will expire in 24 hours.
+    
+    If you didn't request a password reset, you can safely ignore this email.
+    
+    Best regards,
+    The Thuwala Co. Team
+    """
+
+    return queue_email(user_email, "Password Reset Request - Thuwala Co.", text, html)
 
 
 # Add a custom template filter for darkening colors
@@ -606,6 +3734,77 @@ def init_or_migrate_database():
                 )
                 return False
 
+        existing_tables = set(inspector.get_table_names())
+
+        # Image metadata columns added after the tables first shipped
+        for model in (Portfolio, Advertisement):
+            table = model.__tablename__
+            if table not in existing_tables:
+                continue
+            present = {col["name"] for col in inspector.get_columns(table)}
+            for name in IMAGE_METADATA_FIELDS:
+                if name in present:
+                    continue
+                column_type = model.__table__.c[name].type.compile(dialect=db.engine.dialect)
+                try:
+                    db.session.execute(
+                        text(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+                    )
+                    db.session.commit()
+                    app.logger.info("Added '%s' column to %s table", name, table)
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning("Could not add '%s' column to %s: %s", name, table, e)
+
+        # Digest bookkeeping; messages older than the column count as announced
+        if "contact_message" in existing_tables:
+            present = {col["name"] for col in inspector.get_columns("contact_message")}
+            if "notified_at" not in present:
+                column_type = ContactMessage.__table__.c.notified_at.type.compile(
+                    dialect=db.engine.dialect
+                )
+                try:
+                    db.session.execute(
+                        text(f"ALTER TABLE contact_message ADD COLUMN notified_at {column_type}")
+                    )
+                    db.session.execute(
+                        text(
+                            "UPDATE contact_message "
+                            "SET notified_at = COALESCE(created_at, CURRENT_TIMESTAMP)"
+                        )
+                    )
+                    db.session.commit()
+                    app.logger.info("Added 'notified_at' column to contact_message table")
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning("Could not add 'notified_at' column: %s", e)
+
+        # Tag names were VARCHAR(300) at first; SQLite ignores the length,
+        # Postgres needs the columns widened to TEXT.
+        if "tag" in existing_tables and db.engine.dialect.name == "postgresql":
+            for col in inspector.get_columns("tag"):
+                if col["name"] in ("name", "slug") and getattr(col["type"], "length", None):
+                    try:
+                        db.session.execute(
+                            text(f"ALTER TABLE tag ALTER COLUMN {col['name']} TYPE TEXT")
+                        )
+                        db.session.commit()
+                        app.logger.info("Widened tag.%s to TEXT", col["name"])
+                    except Exception as e:
+                        db.session.rollback()
+                        app.logger.warning("Could not widen tag.%s: %s", col["name"], e)
+
+        # Indexes declared on the models are only created by create_all() for
+        # brand-new tables, so add any that are missing on existing ones.
+        for model in (Portfolio, ContactMessage):
+            if model.__tablename__ not in existing_tables:
+                continue
+            for index in model.__table__.indexes:
+                try:
+                    index.create(bind=db.engine, checkfirst=True)
+                except Exception as e:
+                    app.logger.warning("Could not create index %s: %s", index.name, e)
+
         return True
     except Exception as e:
         print(f"⚠️ Database inspection error: {e}")
@@ -632,7 +3831,7 @@ def init_db():
             admin = User(
                 username="admin",
                 email="admin@thuwalaco.com",
-                password_hash=generate_password_hash("Admin@2024"),
+                password_hash=hash_password("Admin@2024"),
             )
             db.session.add(admin)
             print("Admin user created")
@@ -732,10 +3931,16 @@ def init_db():
                 db.session.add(portfolio)
 
             db.session.commit()
+            portfolio_facets.invalidate()
             print(f"Added {len(sample_portfolio)} portfolio items")
         else:
             print(f"Portfolio already has {Portfolio.query.count()} items")
 
+        # Backfill normalized tag rows from the comma-separated columns
+        tagged = backfill_tags()
+        if tagged:
+            print(f"Backfilled tags for {tagged} portfolio items/services")
+
         # Add sample advertisements if none exist
         try:
             ad_count = Advertisement.query.count()
@@ -779,6 +3984,29 @@ def init_db():
 
         db.session.commit()
 
+        # Build the site search index once the seed content is in place
+        search_index.rebuild()
+
+        # Track which rows use which uploaded files
+        backfill_upload_references()
+
+        # Resume image processing for uploads that never got variants
+        queued = enqueue_missing_image_variants()
+        if queued:
+            print(f"Queued {queued} uploaded images for processing")
+
+        start_upload_gc_timer()
+
+        # Send mail left in the outbox by a previous process
+        start_mail_worker()
+
+        # Replay contact submissions journaled by a process that died
+        contact_journal.recover()
+
+        # Announce contact messages a previous process never got to
+        if ContactMessage.query.filter(ContactMessage.notified_at.is_(None)).first():
+            schedule_contact_digest()
+
         print("✅ Database initialization complete!")
         print("=" * 50)
 
@@ -824,6 +4052,10 @@ def index():
                     "image_url": ad.image_url,
                     "background_color": ad.background_color,
                     "text_color": ad.text_color,
+                    "image_width": ad.image_width,
+                    "image_height": ad.image_height,
+                    "image_color": ad.image_color,
+                    "image_placeholder": ad.image_placeholder,
                 }
                 for ad in ads_query
             ]
@@ -923,62 +4155,78 @@ def services():
 
 @app.route("/portfolio")
 def portfolio():
-    # Get filter category from query parameter
+    # Get filters from query parameters (category and featured can combine)
     category_filter = request.args.get("category", "all")
+    featured_only = request.args.get("featured") in ("1", "true", "yes")
+    tech_filter = " ".join(request.args.get("tech", "").split())
     try:
-
-        # Query portfolio items
-        if category_filter == "all":
-            portfolio_items = Portfolio.query.order_by(
-                Portfolio.featured.desc(), Portfolio.created_at.desc()
-            ).all()
-        else:
-            portfolio_items = (
-                Portfolio.query.filter_by(category=category_filter)
-                .order_by(Portfolio.featured.desc(), Portfolio.created_at.desc())
-                .all()
+        # The facets are per-worker and may be stale, so they only feed the
+        # filter bar counts; the listing itself always comes from the query.
+        query = Portfolio.query
+        if category_filter != "all":
+            query = query.filter_by(category=category_filter)
+        if featured_only:
+            query = query.filter_by(featured=True)
+        if tech_filter:
+            query = (
+                query.join(Portfolio.technology_links)
+                .join(PortfolioTag.tag)
+                .filter(
+                    Tag.kind == TAG_KIND_TECHNOLOGY,
+                    Tag.slug == tag_slug(tech_filter),
+                )
             )
-        if not portfolio_items:
-            fallback_items = get_portfolio_fallback()
-            if category_filter == "all":
-                portfolio_items = fallback_items
-            else:
-                portfolio_items = [
-                    item
-                    for item in fallback_items
-                    if item.get("category") == category_filter
-                ]
+        portfolio_items = query.order_by(
+            Portfolio.featured.desc(), Portfolio.created_at.desc()
+        ).all()
 
-        # Get unique categories for filter
-        categories = db.session.query(Portfolio.category).distinct().all()
-        categories = [cat[0] for cat in categories if cat[0]]
-        if not categories:
-            categories = sorted(
-                {item.get("category") for item in get_portfolio_fallback()}
+        facets = portfolio_facets.get()
+        if not portfolio_items and db.session.query(Portfolio.id).first() is None:
+            portfolio_items = filter_portfolio_fallback(
+                category_filter, featured_only, tech_filter
             )
+        elif facets["source"] == "fallback":
+            # Built before the first real item was added (possibly by
+            # another worker): recount now instead of waiting for the TTL.
+            portfolio_facets.invalidate()
+            facets = portfolio_facets.get()
 
     except Exception as e:
         print(f"Database error in portfolio route: {e}")
-        fallback_items = get_portfolio_fallback()
-        if category_filter == "all":
-            portfolio_items = fallback_items
-        else:
-            portfolio_items = [
-                item
-                for item in fallback_items
-                if item.get("category") == category_filter
-            ]
-        categories = sorted({item.get("category") for item in fallback_items})
+        db.session.rollback()
+        portfolio_items = filter_portfolio_fallback(
+            category_filter, featured_only, tech_filter
+        )
+        facets = PortfolioFacetIndex.from_items(get_portfolio_fallback())
 
     return render_template(
         "portfolio.html",
         portfolio_items=portfolio_items,
-        categories=categories,
+        categories=sorted(facets["categories"]),
+        facets=facets,
         current_category=category_filter,
+        featured_only=featured_only,
+        current_tech=tech_filter,
     )
 
 
+@app.route("/search")
+def search():
+    query = request.args.get("q", "").strip()[:200]
+    results = []
+    if query:
+        search_index.ensure_built()
+        results = search_index.search(
+            query, limit=app.config.get("SEARCH_RESULTS_LIMIT", 20)
+        )
+        for result in results:
+            result["url"] = url_for(result["endpoint"], **result["url_values"])
+    return render_template("search.html", query=query, results=results)
+
+
 @app.route("/contact", methods=["GET", "POST"])
+@contact_filtered
+@rate_limited("contact.html")
 def contact():
     if request.method == "POST":
         name = request.form.get("name", "").strip()
@@ -990,21 +4238,43 @@ def contact():
         inquiry_type = request.form.get("inquiry_type", "").strip()
 
         # --- 1. Try saving to the database (works on paid hosting) ---
+        # A repeat of a stored message (see contact_filtered) is not saved
+        # again; it only gets the WhatsApp hand-off once more.
+        duplicate = g.pop("contact_duplicate", False)
         db_saved = False
-        try:
-            new_message = ContactMessage(
-                name=name,
-                email=email,
-                phone=phone,
-                subject=subject,
-                message=message,
-            )
-            db.session.add(new_message)
-            db.session.commit()
-            db_saved = True
-        except Exception as e:
-            db.session.rollback()
-            app.logger.warning("Could not save contact message to DB: %s", e)
+        if app.config.get("CONTACT_INGESTION") == "journal" and not duplicate:
+            try:
+                contact_journal.append(
+                    {
+                        "name": name,
+                        "email": email,
+                        "phone": phone,
+                        "subject": subject,
+                        "message": message,
+                        "created_at": datetime.utcnow().isoformat(),
+                    }
+                )
+                db_saved = True
+            except OSError as e:
+                app.logger.warning("Could not journal contact message, inserting: %s", e)
+        if not db_saved and not duplicate:
+            try:
+                new_message = ContactMessage(
+                    name=name,
+                    email=email,
+                    phone=phone,
+                    subject=subject,
+                    message=message,
+                )
+                db.session.add(new_message)
+                db.session.commit()
+                db_saved = True
+                schedule_contact_digest()
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning("Could not save contact message to DB: %s", e)
+        if db_saved:
+            contact_filter.remember(email, message)
 
         # --- 2. WhatsApp redirect (ideal for Vercel / no-DB hosting) ---
         if app.config.get("WHATSAPP_ENABLED"):
@@ -1042,6 +4312,7 @@ def contact():
 
 # Password Reset Routes
 @app.route("/admin/forgot-password", methods=["GET", "POST"])
+@rate_limited("admin/forgot_password.html", user_field="email")
 def forgot_password():
     """Handle forgot password requests"""
     if current_user.is_authenticated:
@@ -1076,19 +4347,17 @@ def forgot_password():
                 ).delete()
 
                 db.session.add(reset_token)
-                db.session.commit()
 
-                # Generate reset URL
+                # Queue the email in the same transaction; it is sent in the background
                 reset_url = url_for("reset_password", token=token, _external=True)
+                queue_password_reset_email(user.email, reset_url)
+                db.session.commit()
+                wake_mail_delivery()
 
-                # Send email
-                if send_password_reset_email(user.email, reset_url):
-                    flash(
-                        "Password reset instructions have been sent to your email.",
-                        "success",
-                    )
-                else:
-                    flash("Error sending email. Please contact support.", "error")
+                flash(
+                    "Password reset instructions have been sent to your email.",
+                    "success",
+                )
 
             except Exception as e:
                 db.session.rollback()
@@ -1143,11 +4412,12 @@ def reset_password(token):
         # Update user password
         user = User.query.get(reset_token.user_id)
         if user:
-            user.password_hash = generate_password_hash(password)
+            user.password_hash = hash_password(password)
             reset_token.is_used = True
 
             try:
                 db.session.commit()
+                user_cache.invalidate(user.id)
                 flash(
                     "Password has been reset successfully. You can now login with your new password.",
                     "success",
@@ -1178,12 +4448,12 @@ def change_password():
             return redirect(url_for("change_password"))
 
         # Verify current password
-        if not check_password_hash(current_user.password_hash, current_password):
+        if not verify_password(current_user.password_hash, current_password):
             flash("Current password is incorrect", "error")
             return redirect(url_for("change_password"))
 
-        # Check if new password is different
-        if check_password_hash(current_user.password_hash, new_password):
+        # Check if new password is different (no second hash check needed)
+        if new_password == current_password:
             flash("New password must be different from current password", "error")
             return redirect(url_for("change_password"))
 
@@ -1197,10 +4467,11 @@ def change_password():
             return redirect(url_for("change_password"))
 
         # Update password
-        current_user.password_hash = generate_password_hash(new_password)
+        current_user.password_hash = hash_password(new_password)
 
         try:
             db.session.commit()
+            user_cache.invalidate(current_user.id)
             flash("Password changed successfully", "success")
 
             # Log user out and redirect to login page
@@ -1217,6 +4488,7 @@ def change_password():
 
 # Admin Routes
 @app.route("/admin/login", methods=["GET", "POST"])
+@rate_limited("admin/login.html", user_field="username", user_per_ip=True)
 def admin_login():
     if current_user.is_authenticated:
         return redirect(url_for("admin_dashboard"))
@@ -1230,15 +4502,20 @@ def admin_login():
             flash("Invalid credentials", "error")
             return render_template("admin/login.html")
 
-        try:
-            pw_ok = check_password_hash(user.password_hash, password)
-        except Exception:
-            pw_ok = False
-
-        if not pw_ok:
+        if not verify_password(user.password_hash, password):
             flash("Invalid credentials", "error")
             return render_template("admin/login.html")
 
+        # Upgrade hashes made with older parameters while we have the password
+        if password_needs_rehash(user.password_hash):
+            try:
+                user.password_hash = hash_password(password)
+                db.session.commit()
+                user_cache.invalidate(user.id)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.warning("Could not upgrade password hash for %s: %s", user.id, e)
+
         login_user(user)
         return redirect(url_for("admin_dashboard"))
 
@@ -1343,11 +4620,14 @@ def add_service():
                 details=request.form.get("details"),
                 category=request.form.get("category"),
             )
+            sync_tags(service, service.details, TAG_KIND_SERVICE_DETAIL)
             db.session.add(service)
             db.session.commit()
+            search_index.index_service(service)
             flash("Service added successfully!", "success")
             return redirect(url_for("admin_services"))
         except Exception as e:
+            db.session.rollback()
             flash(f"Error adding service: {str(e)}", "error")
 
     return render_template("admin/edit_service.html", categories=SERVICE_CATEGORIES)
@@ -1365,11 +4645,14 @@ def edit_service(service_id):
             service.icon = request.form.get("icon")
             service.details = request.form.get("details")
             service.category = request.form.get("category")
+            sync_tags(service, service.details, TAG_KIND_SERVICE_DETAIL)
 
             db.session.commit()
+            search_index.index_service(service)
             flash("Service updated successfully!", "success")
             return redirect(url_for("admin_services"))
         except Exception as e:
+            db.session.rollback()
             flash(f"Error updating service: {str(e)}", "error")
 
     return render_template(
@@ -1382,8 +4665,11 @@ def edit_service(service_id):
 def delete_service(service_id):
     try:
         service = Service.query.get_or_404(service_id)
+        tag_ids = owner_tag_ids(service)
         db.session.delete(service)
+        delete_orphan_tags(tag_ids)
         db.session.commit()
+        search_index.remove("service", service_id)
         flash("Service deleted successfully!", "success")
     except Exception as e:
         flash(f"Error deleting service: {str(e)}", "error")
@@ -1413,6 +4699,7 @@ def add_portfolio():
         try:
             # Handle file upload for image
             image_url = request.form.get("image_url", "").strip() or None
+            uploaded_url = None
             if has_uploaded_file("image_file"):
                 uploaded_url, upload_err = save_uploaded_image(
                     request.files["image_file"], "portfolio"
@@ -1438,11 +4725,20 @@ def add_portfolio():
                 client_role=request.form.get("client_role"),
                 featured=bool(request.form.get("featured")),
             )
+            sync_tags(portfolio, portfolio.technologies, TAG_KIND_TECHNOLOGY)
             db.session.add(portfolio)
+            db.session.flush()
+            apply_image_metadata(portfolio)
+            sync_upload_reference(portfolio)
             db.session.commit()
+            if uploaded_url:
+                enqueue_image_processing(uploaded_url)
+            portfolio_facets.invalidate()
+            search_index.index_portfolio(portfolio)
             flash("Portfolio item added successfully!", "success")
             return redirect(url_for("admin_portfolio"))
         except Exception as e:
+            db.session.rollback()
             flash(f"Error adding portfolio item: {str(e)}", "error")
 
     return render_template("admin/edit_portfolio.html", categories=SERVICE_CATEGORIES)
@@ -1457,6 +4753,7 @@ def edit_portfolio(item_id):
         try:
             # Handle file upload for image
             image_url = request.form.get("image_url", "").strip() or None
+            uploaded_url = None
             if has_uploaded_file("image_file"):
                 uploaded_url, upload_err = save_uploaded_image(
                     request.files["image_file"], "portfolio"
@@ -1483,11 +4780,19 @@ def edit_portfolio(item_id):
             portfolio.client_name = request.form.get("client_name")
             portfolio.client_role = request.form.get("client_role")
             portfolio.featured = bool(request.form.get("featured"))
+            sync_tags(portfolio, portfolio.technologies, TAG_KIND_TECHNOLOGY)
+            apply_image_metadata(portfolio)
+            sync_upload_reference(portfolio)
 
             db.session.commit()
+            if uploaded_url:
+                enqueue_image_processing(uploaded_url)
+            portfolio_facets.invalidate()
+            search_index.index_portfolio(portfolio)
             flash("Portfolio item updated successfully!", "success")
             return redirect(url_for("admin_portfolio"))
         except Exception as e:
+            db.session.rollback()
             flash(f"Error updating portfolio item: {str(e)}", "error")
 
     return render_template(
@@ -1500,8 +4805,13 @@ def edit_portfolio(item_id):
 def delete_portfolio(item_id):
     try:
         portfolio = Portfolio.query.get_or_404(item_id)
+        release_upload_reference(portfolio)
+        tag_ids = owner_tag_ids(portfolio)
         db.session.delete(portfolio)
+        delete_orphan_tags(tag_ids)
         db.session.commit()
+        portfolio_facets.invalidate()
+        search_index.remove("portfolio", item_id)
         flash("Portfolio item deleted successfully!", "success")
     except Exception as e:
         flash(f"Error deleting portfolio item: {str(e)}", "error")
@@ -1576,6 +4886,7 @@ def add_advertisement():
         try:
             # --- Resolve image: uploaded file takes priority over URL ---
             image_url = None
+            uploaded_url = None
             if has_uploaded_file("image_file"):
                 uploaded_url, upload_err = save_uploaded_image(
                     request.files["image_file"], "ads"
@@ -1621,7 +4932,12 @@ def add_advertisement():
             )
 
             db.session.add(ad)
+            db.session.flush()
+            apply_image_metadata(ad)
+            sync_upload_reference(ad)
             db.session.commit()
+            if uploaded_url:
+                enqueue_image_processing(uploaded_url)
 
             flash("Advertisement created successfully!", "success")
             return redirect(url_for("admin_advertisements"))
@@ -1643,6 +4959,7 @@ def edit_advertisement(ad_id):
     if request.method == "POST":
         try:
             # --- Resolve image ---
+            uploaded_url = None
             if request.form.get("remove_image"):
                 ad.image_url = None
             elif has_uploaded_file("image_file"):
@@ -1688,8 +5005,12 @@ def edit_advertisement(ad_id):
             ad.text_color = request.form.get("text_color") or "#ffffff"
             ad.is_active = bool(request.form.get("is_active"))
             ad.display_order = int(request.form.get("display_order", 0) or 0)
+            apply_image_metadata(ad)
+            sync_upload_reference(ad)
 
             db.session.commit()
+            if uploaded_url:
+                enqueue_image_processing(uploaded_url)
             flash("Advertisement updated successfully!", "success")
             return redirect(url_for("admin_advertisements"))
 
@@ -1726,6 +5047,7 @@ def delete_advertisement(ad_id):
     """Delete advertisement"""
     try:
         ad = Advertisement.query.get_or_404(ad_id)
+        release_upload_reference(ad)
         db.session.delete(ad)
         db.session.commit()
         flash("Advertisement deleted successfully!", "success")
@@ -1847,7 +5169,7 @@ def add_user():
         new_user = User(
             username=username,
             email=email,
-            password_hash=generate_password_hash(password),
+            password_hash=hash_password(password),
         )
 
         try:
@@ -1872,9 +5194,37 @@ def test_email():
         return "Not available in production", 403
 
     reset_url = url_for("reset_password", token="test-token-123", _external=True)
-    success = send_password_reset_email("test@example.com", reset_url)
+    queue_password_reset_email("test@example.com", reset_url)
+    db.session.commit()
+    counts = deliver_pending_emails()
+
+    return f"Outbox delivery: {counts}<br>Reset URL: {reset_url}"
+
 
-    return f"Test email sent: {success}<br>Reset URL: {reset_url}"
+@app.route("/admin/rate-limits")
+@login_required
+def admin_rate_limits():
+    """This worker's rate limiter and contact filter counters."""
+    storage = type(rate_limiter.storage).__name__
+    with rate_limiter._lock:
+        counts = {name: dict(c) for name, c in rate_limiter.counts.items()}
+        recent = list(rate_limiter.recent_rejections)
+    with contact_filter._lock:
+        contact_counts = dict(contact_filter.counts)
+    return jsonify(
+        {
+            "worker": os.getpid(),
+            "enabled": app.config.get("RATE_LIMIT_ENABLED", True),
+            "storage": storage,
+            "rules": app.config.get("RATE_LIMITS", {}),
+            "counts": counts,
+            "recent_rejections": recent,
+            "contact_filter": {
+                "enabled": app.config.get("CONTACT_FILTER_ENABLED", True),
+                "counts": contact_counts,
+            },
+        }
+    )
 
 
 # Debug route to check advertisements (admin-only)
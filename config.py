@@ -28,10 +28,27 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL", _default_db)
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Create tables, seed data and start the background workers on the first
+    # request; build scripts that only render pages turn this off.
+    INIT_DB_ON_REQUEST = os.environ.get("INIT_DB_ON_REQUEST", "true").lower() == "true"
 
     # Upload folder configuration
     UPLOAD_FOLDER = os.environ.get("UPLOAD_FOLDER", "static/uploads")
     MAX_CONTENT_LENGTH = int(os.environ.get("MAX_CONTENT_LENGTH", 16 * 1024 * 1024))
+    UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 64 * 1024))
+    # Per-file limits, checked while the upload streams in.  Override single
+    # types with e.g. UPLOAD_SIZE_LIMITS="svg:1048576,gif:8388608".
+    UPLOAD_MAX_FILE_SIZE = int(os.environ.get("UPLOAD_MAX_FILE_SIZE", 10 * 1024 * 1024))
+    UPLOAD_SIZE_LIMITS = {
+        ext.strip().lower(): int(limit)
+        for ext, limit in (
+            item.split(":", 1)
+            for item in os.environ.get(
+                "UPLOAD_SIZE_LIMITS", "svg:1048576,ico:1048576,gif:8388608"
+            ).split(",")
+            if ":" in item
+        )
+    }
     ALLOWED_EXTENSIONS = set(
         os.environ.get(
             "ALLOWED_EXTENSIONS",
@@ -47,6 +64,46 @@ class Config:
     MAIL_PASSWORD = os.environ.get("MAIL_PASSWORD", "")
     MAIL_DEFAULT_SENDER = os.environ.get("MAIL_DEFAULT_SENDER", "noreply@thuwalaco.com")
 
+    # Outbound mail is queued in the outbox table and delivered by 'thread'
+    # (background thread per worker), 'sync' (after the request commits) or
+    # 'external' (scripts/send_mail.py, e.g. from cron).
+    MAIL_DELIVERY = os.environ.get("MAIL_DELIVERY", "thread").lower()
+    MAIL_POLL_INTERVAL = int(os.environ.get("MAIL_POLL_INTERVAL", 30))
+    MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", 50))
+    MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 6))
+    # Retry delay in seconds, doubling per failed attempt up to MAIL_RETRY_MAX
+    MAIL_RETRY_BASE = int(os.environ.get("MAIL_RETRY_BASE", 60))
+    MAIL_RETRY_MAX = int(os.environ.get("MAIL_RETRY_MAX", 3600))
+    MAIL_TIMEOUT = int(os.environ.get("MAIL_TIMEOUT", 20))
+    # Seconds an idle SMTP connection is kept open for the next message
+    MAIL_CONNECTION_IDLE = int(os.environ.get("MAIL_CONNECTION_IDLE", 60))
+
+    # New contact messages are announced at most once per window (seconds,
+    # 0 = off) by email to CONTACT_DIGEST_EMAIL and/or a JSON POST to
+    # CONTACT_DIGEST_WEBHOOK; with neither set no digests are sent.
+    CONTACT_DIGEST_WINDOW = int(os.environ.get("CONTACT_DIGEST_WINDOW", 300))
+    CONTACT_DIGEST_EMAIL = os.environ.get("CONTACT_DIGEST_EMAIL", "")
+    CONTACT_DIGEST_WEBHOOK = os.environ.get("CONTACT_DIGEST_WEBHOOK", "")
+
+    # Contact form ingestion: 'direct' (INSERT + COMMIT per submission) or
+    # 'journal' (append to a local journal file that a background flusher
+    # batch-inserts every CONTACT_FLUSH_INTERVAL_MS; replayed after a crash).
+    # The journal defaults to instance/contact-journal.
+    CONTACT_INGESTION = os.environ.get("CONTACT_INGESTION", "direct").lower()
+    CONTACT_JOURNAL_DIR = os.environ.get("CONTACT_JOURNAL_DIR", "")
+    CONTACT_JOURNAL_FSYNC = os.environ.get("CONTACT_JOURNAL_FSYNC", "true").lower() == "true"
+    CONTACT_FLUSH_INTERVAL_MS = int(os.environ.get("CONTACT_FLUSH_INTERVAL_MS", 250))
+
+    # Contact spam filter, checked before anything is stored: forms sent
+    # sooner than CONTACT_MIN_SUBMIT_SECONDS after rendering, or older than
+    # CONTACT_FORM_MAX_AGE, are dropped, as is the same email + message seen
+    # within CONTACT_DEDUPE_SECONDS (up to CONTACT_DEDUPE_SIZE kept per worker).
+    CONTACT_FILTER_ENABLED = os.environ.get("CONTACT_FILTER_ENABLED", "true").lower() == "true"
+    CONTACT_MIN_SUBMIT_SECONDS = float(os.environ.get("CONTACT_MIN_SUBMIT_SECONDS", 3))
+    CONTACT_FORM_MAX_AGE = int(os.environ.get("CONTACT_FORM_MAX_AGE", 86400))
+    CONTACT_DEDUPE_SECONDS = int(os.environ.get("CONTACT_DEDUPE_SECONDS", 3600))
+    CONTACT_DEDUPE_SIZE = int(os.environ.get("CONTACT_DEDUPE_SIZE", 10000))
+
     # Password reset settings
     PASSWORD_RESET_TOKEN_EXPIRE_HOURS = int(
         os.environ.get("PASSWORD_RESET_TOKEN_EXPIRE_HOURS", 24)
@@ -59,7 +116,105 @@ class Config:
             )
         SECURITY_PASSWORD_SALT = "password-reset-salt-change-this"
 
+    # Password hashing: any Werkzeug method string; tune it for this host
+    # with scripts/benchmark_password_hash.py.  Older hashes are upgraded on
+    # the next successful login.
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    # Seconds each worker reuses a logged-in user without querying it (0 = off)
+    USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 30))
+    # Sessions stored a bare user id before they carried a generation; those
+    # are accepted once and rotated.  Turn off once old sessions have expired.
+    ACCEPT_LEGACY_SESSION_IDS = (
+        os.environ.get("ACCEPT_LEGACY_SESSION_IDS", "true").lower() == "true"
+    )
+
     # WhatsApp integration (for Vercel / no-database deployments)
     # Set WHATSAPP_ENABLED=true to redirect contact-form submissions to WhatsApp.
     WHATSAPP_ENABLED = os.environ.get("WHATSAPP_ENABLED", "true").lower() == "true"
     WHATSAPP_NUMBER = os.environ.get("WHATSAPP_NUMBER", "265887873006")
+
+    # Portfolio filter-bar counts are cached in each worker and rebuilt after
+    # local writes; the TTL bounds how stale another worker's copy can be.
+    PORTFOLIO_FACET_TTL = int(os.environ.get("PORTFOLIO_FACET_TTL", 300))
+
+    # Rate limits on form POSTs: "<endpoint>" is per client IP, "<endpoint>:user"
+    # per submitted username/email (per IP + username for the login); values
+    # are "bucket:<limit>/<seconds>" (token bucket) or "window:<limit>/<seconds>"
+    # (sliding window).
+    RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMITS = {
+        "contact": os.environ.get("RATE_LIMIT_CONTACT", "bucket:5/600"),
+        "admin_login": os.environ.get("RATE_LIMIT_LOGIN", "window:20/300"),
+        "admin_login:user": os.environ.get("RATE_LIMIT_LOGIN_USER", "window:5/300"),
+        "forgot_password": os.environ.get("RATE_LIMIT_FORGOT_PASSWORD", "bucket:5/900"),
+        "forgot_password:user": os.environ.get(
+            "RATE_LIMIT_FORGOT_PASSWORD_USER", "window:3/3600"
+        ),
+    }
+    # 'sqlite' (temp file shared by this host's workers), 'sqlite:///<path>',
+    # 'memory' (per worker) or a redis:// URL
+    RATE_LIMIT_STORAGE = os.environ.get("RATE_LIMIT_STORAGE", "sqlite")
+    # Proxies in front of the app whose X-Forwarded-For is trusted (1 on Render)
+    RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get("RATE_LIMIT_TRUSTED_PROXIES", 0))
+
+    # Site search: in-memory index rebuilt per worker after this many seconds
+    SEARCH_INDEX_TTL = int(os.environ.get("SEARCH_INDEX_TTL", 300))
+    SEARCH_RESULTS_LIMIT = int(os.environ.get("SEARCH_RESULTS_LIMIT", 20))
+
+    # Upload image pipeline: 'async' (background thread), 'sync' or 'off'.
+    IMAGE_PROCESSING = os.environ.get("IMAGE_PROCESSING", "async").lower()
+    IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+    IMAGE_VARIANT_WIDTHS = sorted(
+        int(w) for w in os.environ.get("IMAGE_VARIANT_WIDTHS", "480,960,1600").split(",")
+    )
+    # Add 'avif' to also generate AVIF (needs a Pillow build with AVIF support)
+    IMAGE_VARIANT_FORMATS = [
+        f.strip().lower()
+        for f in os.environ.get("IMAGE_VARIANT_FORMATS", "webp").split(",")
+        if f.strip()
+    ]
+    IMAGE_WEBP_QUALITY = int(os.environ.get("IMAGE_WEBP_QUALITY", 80))
+    IMAGE_AVIF_QUALITY = int(os.environ.get("IMAGE_AVIF_QUALITY", 55))
+    IMAGE_VARIANT_TTL = int(os.environ.get("IMAGE_VARIANT_TTL", 300))
+    # Variants of the images under static/, written by scripts/generate_webp.py
+    IMAGE_MANIFEST = os.environ.get("IMAGE_MANIFEST", "image-manifest.json")
+
+    # Orphaned upload cleanup (see scripts/upload_gc.py).  Files younger than
+    # the grace period are kept; set UPLOAD_GC_INTERVAL (seconds) to also run
+    # it periodically in each worker.
+    UPLOAD_GC_GRACE_SECONDS = int(os.environ.get("UPLOAD_GC_GRACE_SECONDS", 86400))
+    UPLOAD_GC_INTERVAL = int(os.environ.get("UPLOAD_GC_INTERVAL", 0))
+    UPLOAD_GC_QUARANTINE = os.environ.get("UPLOAD_GC_QUARANTINE", "false").lower() == "true"
+
+    # Let the fronting proxy stream /static/ files: 'off', 'x-sendfile' or
+    # 'x-accel-redirect' (nginx; internal location STATIC_OFFLOAD_PREFIX must
+    # alias the static folder).  STATIC_OFFLOAD_EMULATE serves the headers
+    # in-process for local runs without a proxy.
+    STATIC_OFFLOAD = os.environ.get("STATIC_OFFLOAD", "off").lower()
+    STATIC_OFFLOAD_PREFIX = os.environ.get("STATIC_OFFLOAD_PREFIX", "/_static/")
+    STATIC_OFFLOAD_EMULATE = (
+        os.environ.get("STATIC_OFFLOAD_EMULATE", "false").lower() == "true"
+    )
+
+    # Fingerprinted static asset names (see scripts/build_assets.py).  The
+    # manifest lives in the static folder; plain names are used without it.
+    ASSET_FINGERPRINTING = (
+        os.environ.get("ASSET_FINGERPRINTING", "true").lower() == "true"
+    )
+    ASSET_MANIFEST = os.environ.get("ASSET_MANIFEST", "asset-manifest.json")
+
+    # Compression of dynamic text responses (HTML, JSON).  Bodies smaller
+    # than COMPRESS_MIN_SIZE bytes are sent as-is.  Brotli quality runs 0-11
+    # and gzip level 1-9; the defaults favour speed for per-request work.
+    COMPRESS_RESPONSES = os.environ.get("COMPRESS_RESPONSES", "true").lower() == "true"
+    COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", 5))
+    COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", 6))
+
+    # Inline per-page critical CSS (scripts/build_critical_css.py) and load
+    # the full stylesheets asynchronously on pages that have it.
+    CRITICAL_CSS = os.environ.get("CRITICAL_CSS", "true").lower() == "true"
+
+    # Send Link: rel=preload headers (and 103 Early Hints where the server
+    # supports them) for the CSS, JS and hero images each page uses.
+    PRELOAD_HINTS = os.environ.get("PRELOAD_HINTS", "true").lower() == "true"
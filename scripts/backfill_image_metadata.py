@@ -0,0 +1,33 @@
+"""Compute image size, dominant color and blur placeholder for existing rows.
+
+Run from the project root:
+    python scripts/backfill_image_metadata.py          # rows missing metadata
+    python scripts/backfill_image_metadata.py --force  # recompute every row
+
+New and edited portfolio items and advertisements get this automatically.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, backfill_image_metadata, init_or_migrate_database  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill image metadata.")
+    parser.add_argument(
+        "--force", action="store_true", help="Recompute rows that already have it"
+    )
+    args = parser.parse_args()
+
+    with app.app_context():
+        init_or_migrate_database()  # adds the metadata columns on older databases
+        updated = backfill_image_metadata(force=args.force)
+    print(f"Updated image metadata for {updated} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Pick password hashing parameters that hit a target latency on this host.
+
+Run on the machine that serves the app:
+    python scripts/benchmark_password_hash.py
+    python scripts/benchmark_password_hash.py --target-ms 300 --rounds 5
+
+Times Werkzeug's check_password_hash (what a login costs) for pbkdf2
+iteration counts and scrypt cost factors, and prints the strongest setting
+of each kind that stays under the target.  Put the chosen one in
+PASSWORD_HASH_METHOD; existing hashes are upgraded as users log in.
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PBKDF2_STEP = 10_000
+SCRYPT_COST_EXPONENTS = range(14, 19)  # N = 16384 ... 262144 (16-256 MB with r=8)
+
+
+def time_method(method: str, rounds: int) -> float:
+    """Median milliseconds for one check_password_hash with this method."""
+    stored = generate_password_hash("benchmark-password", method=method)
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        check_password_hash(stored, "benchmark-password")
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def pick_pbkdf2(target_ms: float, rounds: int) -> tuple[str, float]:
+    # Cost is linear in the iteration count: calibrate once, then confirm
+    def scaled(iterations: int, elapsed: float) -> int:
+        estimate = int(iterations * target_ms / elapsed) // PBKDF2_STEP * PBKDF2_STEP
+        return max(PBKDF2_STEP, estimate)
+
+    iterations = scaled(100_000, time_method("pbkdf2:sha256:100000", rounds))
+    while True:
+        method = f"pbkdf2:sha256:{iterations}"
+        elapsed = time_method(method, rounds)
+        if elapsed <= target_ms or iterations <= PBKDF2_STEP:
+            return method, elapsed
+        iterations = min(iterations - PBKDF2_STEP, scaled(iterations, elapsed))
+
+
+def pick_scrypt(target_ms: float, rounds: int) -> tuple[str, float] | None:
+    best = None
+    for exponent in SCRYPT_COST_EXPONENTS:
+        method = f"scrypt:{2 ** exponent}:8:1"
+        try:
+            elapsed = time_method(method, rounds)
+        except (ValueError, MemoryError) as e:
+            print(f"  {method:24s} unavailable: {e}")
+            break
+        print(f"  {method:24s} {elapsed:8.1f} ms")
+        if elapsed > target_ms:
+            break
+        best = (method, elapsed)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Find password hash parameters for a target login latency."
+    )
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        default=250,
+        help="Acceptable time for one password check (default 250 ms)",
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=3, help="Timings per candidate (default 3)"
+    )
+    args = parser.parse_args()
+
+    print(f"Target: {args.target_ms:.0f} ms per check on {os.cpu_count()} CPUs")
+    current = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+    print(f"  {current:24s} {time_method(current, args.rounds):8.1f} ms  (current)")
+
+    pbkdf2_method, pbkdf2_ms = pick_pbkdf2(args.target_ms, args.rounds)
+    print(f"  {pbkdf2_method:24s} {pbkdf2_ms:8.1f} ms")
+    scrypt = pick_scrypt(args.target_ms, args.rounds)
+
+    print("\nRecommended (scrypt is memory-hard and preferred when it fits):")
+    if scrypt:
+        print(f"  PASSWORD_HASH_METHOD={scrypt[0]}")
+    print(f"  PASSWORD_HASH_METHOD={pbkdf2_method}")
+    print(
+        "Each gunicorn worker runs one check at a time, so keep the worker "
+        "count at or below the CPU count."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Build and fingerprint static assets for long-lived caching.
+
+Run from the project root before deploying (or after changing CSS/JS/images):
+    python scripts/build_assets.py
+
+First the Tailwind stylesheet is compiled from src/tailwind.css: utilities
+are purged to those used in templates/**/*.html and static/js (see
+tailwind.config.js) and minified into static/css/tailwind.css.  This needs
+the Tailwind v3 CLI, either `npm ci` here (node_modules/.bin) or a standalone
+binary named by TAILWIND_BIN; without one the build fails, since the pages
+would otherwise be served without their utility classes.  base.html uses
+the Tailwind CDN script while no compiled stylesheet exists (local
+checkouts, Vercel); --skip-tailwind keeps whatever is there.
+
+Every file under static/ (except uploads/) gets a content-hashed copy beside
+it, e.g. css/style.css -> css/style.3f9a1c2b4d5e.css, and the mapping is
+written to static/asset-manifest.json.  The app rewrites
+url_for('static', ...) to the hashed names and serves them as immutable.
+Copies left over from earlier builds are removed.
+
+Text assets (CSS, JS, SVG, JSON...) also get precompressed `.gz` and, when
+the brotli package is installed, `.br` siblings; the static route picks one
+from Accept-Encoding, so no compression happens at request time.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+try:
+    import brotli
+except ImportError:  # .br siblings are skipped without it
+    brotli = None
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATIC_DIR = os.path.join(PROJECT_DIR, "static")
+TAILWIND_INPUT = os.path.join(PROJECT_DIR, "src", "tailwind.css")
+TAILWIND_OUTPUT = os.path.join(STATIC_DIR, "css", "tailwind.css")
+MANIFEST_NAME = "asset-manifest.json"
+IMAGE_MANIFEST_NAME = "image-manifest.json"  # written by generate_webp.py, read server-side
+HASH_LENGTH = 12
+SKIP_DIRS = ("uploads", "critical")  # uploads are user data; critical CSS is inlined
+HASHED_NAME_RE = re.compile(r"^(.+)\.[0-9a-f]{%d}(\.[^.]+)$" % HASH_LENGTH)
+COMPRESSIBLE_EXTENSIONS = (".css", ".js", ".json", ".svg", ".txt", ".xml", ".map", ".ico")
+COMPRESSED_SUFFIXES = (".gz", ".br")
+MIN_COMPRESS_SIZE = 256  # smaller files gain nothing from compression
+
+
+def tailwind_command() -> list[str] | None:
+    """Locate the Tailwind CLI: TAILWIND_BIN, node_modules, or PATH."""
+    explicit = os.environ.get("TAILWIND_BIN")
+    if explicit:
+        return [explicit]
+    local = os.path.join(PROJECT_DIR, "node_modules", ".bin", "tailwindcss")
+    if os.path.exists(local):
+        return [local]
+    found = shutil.which("tailwindcss")
+    return [found] if found else None
+
+
+def build_tailwind() -> bool:
+    """Compile the purged, minified Tailwind stylesheet.  Returns success."""
+    command = tailwind_command()
+    if command is None:
+        print(
+            "  ERROR: Tailwind CLI not found (run `npm ci` or set TAILWIND_BIN)",
+            file=sys.stderr,
+        )
+        return False
+    tmp_output = TAILWIND_OUTPUT + ".tmp"
+    result = subprocess.run(
+        command
+        + [
+            "--config", os.path.join(PROJECT_DIR, "tailwind.config.js"),
+            "--input", TAILWIND_INPUT,
+            "--output", tmp_output,
+            "--minify",
+        ],
+        cwd=PROJECT_DIR,
+    )
+    if result.returncode != 0 or not os.path.exists(tmp_output):
+        print("  ERROR: Tailwind build failed", file=sys.stderr)
+        return False
+    os.replace(tmp_output, TAILWIND_OUTPUT)
+    print(f"Built static/css/tailwind.css ({os.path.getsize(TAILWIND_OUTPUT) / 1024:.1f} KB)")
+    return True
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def iter_assets(static_dir: str):
+    """Yield (relative path, absolute path) for each source asset."""
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        rel_dir = os.path.relpath(dirpath, static_dir).replace(os.sep, "/")
+        if rel_dir == ".":
+            rel_dir = ""
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for name in sorted(filenames):
+            if name.startswith(".") or name in (MANIFEST_NAME, IMAGE_MANIFEST_NAME):
+                continue
+            if name.endswith(COMPRESSED_SUFFIXES):
+                continue
+            if HASHED_NAME_RE.match(name):
+                continue  # output of an earlier build
+            rel = f"{rel_dir}/{name}" if rel_dir else name
+            yield rel, os.path.join(dirpath, name)
+
+
+def write_compressed(path: str) -> int:
+    """Write .gz/.br siblings of a text asset; return bytes saved by the best one.
+
+    A sibling is only kept when it is actually smaller than the source.
+    """
+    with open(path, "rb") as fh:
+        data = fh.read()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return 0
+    outputs = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        outputs[".br"] = brotli.compress(data, quality=11)
+    best = len(data)
+    for suffix, payload in outputs.items():
+        dest = path + suffix
+        if len(payload) >= len(data):
+            if os.path.exists(dest):
+                os.remove(dest)
+            continue
+        tmp_path = dest + ".tmp"
+        with open(tmp_path, "wb") as fh:
+            fh.write(payload)
+        shutil.copystat(path, tmp_path)
+        os.replace(tmp_path, dest)
+        best = min(best, len(payload))
+    return len(data) - best
+
+
+def build_manifest(static_dir: str, dry_run: bool = False) -> dict:
+    manifest = {}
+    for rel, path in iter_assets(static_dir):
+        stem, ext = os.path.splitext(rel)
+        hashed = f"{stem}.{file_digest(path)}{ext}"
+        manifest[rel] = hashed
+        dest = os.path.join(static_dir, hashed)
+        if not dry_run and not os.path.exists(dest):
+            shutil.copy2(path, dest)
+    return manifest
+
+
+def compress_assets(static_dir: str, manifest: dict) -> tuple[int, int]:
+    """Precompress every compressible source and hashed copy.
+
+    Returns (files compressed, bytes saved per request).
+    """
+    count = saved = 0
+    for rel, hashed in manifest.items():
+        if os.path.splitext(rel)[1].lower() not in COMPRESSIBLE_EXTENSIONS:
+            continue
+        for name in (rel, hashed):
+            saved_here = write_compressed(os.path.join(static_dir, name))
+            if saved_here:
+                count += 1
+                saved += saved_here
+    return count, saved
+
+
+def prune_stale(static_dir: str, manifest: dict) -> list[str]:
+    """Delete hashed copies that are not part of the current manifest."""
+    current = set(manifest.values())
+    removed = []
+    for dirpath, dirnames, filenames in os.walk(static_dir):
+        if os.path.abspath(dirpath) == os.path.abspath(static_dir):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for name in filenames:
+            base = name
+            for suffix in COMPRESSED_SUFFIXES:
+                if base.endswith(suffix):
+                    base = base[: -len(suffix)]
+            if not HASHED_NAME_RE.match(base):
+                continue
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(os.path.join(dirpath, base), static_dir).replace(os.sep, "/")
+            if rel not in current:
+                os.remove(path)
+                removed.append(rel)
+    return removed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build and fingerprint static assets.")
+    parser.add_argument(
+        "--skip-tailwind",
+        action="store_true",
+        help="Do not recompile static/css/tailwind.css",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Print the manifest without writing"
+    )
+    parser.add_argument(
+        "--no-compress",
+        action="store_true",
+        help="Skip writing precompressed .gz/.br siblings",
+    )
+    parser.add_argument(
+        "--keep-stale",
+        action="store_true",
+        help="Keep hashed copies from earlier builds (for pages still cached)",
+    )
+    args = parser.parse_args()
+
+    if not args.skip_tailwind and not args.dry_run and not build_tailwind():
+        sys.exit("Tailwind CSS was not built; pass --skip-tailwind to fingerprint without it")
+    manifest = build_manifest(STATIC_DIR, dry_run=args.dry_run)
+    if args.dry_run:
+        print(json.dumps(manifest, indent=2, sort_keys=True))
+        return
+
+    manifest_path = os.path.join(STATIC_DIR, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    removed = [] if args.keep_stale else prune_stale(STATIC_DIR, manifest)
+    print(f"Fingerprinted {len(manifest)} assets -> static/{MANIFEST_NAME}")
+    if not args.no_compress:
+        count, saved = compress_assets(STATIC_DIR, manifest)
+        formats = "gzip + brotli" if brotli is not None else "gzip (brotli not installed)"
+        print(f"Precompressed {count} files with {formats}, {saved / 1024:.1f} KB smaller")
+    if removed:
+        print(f"Removed {len(removed)} stale copies")
+
+
+if __name__ == "__main__":
+    main()
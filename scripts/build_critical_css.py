@@ -0,0 +1,261 @@
+"""Extract per-page critical CSS for the public pages.
+
+Run from the project root after build_assets.py has compiled Tailwind:
+    python scripts/build_critical_css.py
+
+Each page in PAGES is rendered through the Flask test client.  The "fold"
+is everything in <body> up to the end of the first <section> (navigation
+plus the hero); the rules of the page's local stylesheets whose selectors
+only use tags, classes, ids and attributes present in the fold are written
+to static/critical/<endpoint>.css.  base.html inlines that file through the
+critical_css() template hook and loads the full stylesheets asynchronously.
+
+This is a static approximation of what a headless-browser tool would
+compute: it errs on the side of keeping a rule, never dropping one the
+fold uses.  Stylesheets on external CDNs are not inlined.  Pages are
+rendered with INIT_DB_ON_REQUEST off, so no seeding or background workers
+run at build time.
+"""
+
+import argparse
+import os
+import re
+import sys
+from html.parser import HTMLParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import CRITICAL_CSS_DIR, app, compiled_tailwind, static_url_to_path  # noqa: E402
+
+PAGES = {
+    "index": "/",
+    "services": "/services",
+    "portfolio": "/portfolio",
+    "about": "/about",
+    "contact": "/contact",
+}
+# Inline CSS beyond the first ~14 KB round trip delays first paint instead.
+SIZE_WARNING = 14 * 1024
+
+IDENT = r"(?:\\[0-9a-fA-F]{1,6}\s?|\\.|[\w-])+"
+CLASS_RE = re.compile(r"\.(" + IDENT + ")")
+ID_RE = re.compile(r"#(" + IDENT + ")")
+ATTR_RE = re.compile(r"\[\s*([\w-]+)")
+TAG_RE = re.compile(r"(?:^|[\s>+~(,])([a-zA-Z][\w-]*)")
+PSEUDO_ARGS_RE = re.compile(r"::?[\w-]+\(")
+ESCAPE_RE = re.compile(r"\\([0-9a-fA-F]{1,6})\s?|\\(.)")
+ANIMATION_RE = re.compile(r"animation(?:-name)?\s*:\s*([^;}]+)")
+
+
+def unescape(ident: str) -> str:
+    return ESCAPE_RE.sub(
+        lambda m: chr(int(m.group(1), 16)) if m.group(1) else m.group(2), ident
+    )
+
+
+class FoldCollector(HTMLParser):
+    """Collect tags, classes, ids and attributes above the fold, and the
+    page's stylesheet URLs."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tags, self.classes, self.ids, self.attrs = set(), set(), set(), set()
+        self.stylesheets = []
+        self._section_depth = 0
+        self._done = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "link":
+            rel = (attrs.get("rel") or "").split()
+            if "stylesheet" in rel or (
+                "preload" in rel and attrs.get("as") == "style"
+            ):
+                self.stylesheets.append(attrs.get("href") or "")
+        if self._done:
+            return
+        self.tags.add(tag)
+        self.attrs.update(attrs)
+        self.classes.update((attrs.get("class") or "").split())
+        if attrs.get("id"):
+            self.ids.add(attrs["id"])
+        if tag == "section":
+            self._section_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag == "section" and self._section_depth:
+            self._section_depth -= 1
+            if self._section_depth == 0:
+                self._done = True
+
+
+def split_top_level(text: str, sep: str = ",") -> list[str]:
+    """Split on sep outside parentheses and brackets."""
+    parts, depth, start = [], 0, 0
+    for i, ch in enumerate(text):
+        if ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        elif ch == sep and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def parse_rules(css: str) -> list[tuple[str, str | None]]:
+    """Split a stylesheet into (prelude, body) pairs; body None for `@x ...;`."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    rules, i, n = [], 0, len(css)
+    while i < n:
+        j, quote = i, None
+        while j < n:
+            ch = css[j]
+            if quote:
+                if ch == "\\":
+                    j += 1
+                elif ch == quote:
+                    quote = None
+            elif ch in "\"'":
+                quote = ch
+            elif ch in "{;":
+                break
+            j += 1
+        if j >= n:
+            break
+        prelude = css[i:j].strip()
+        if css[j] == ";":
+            rules.append((prelude, None))
+            i = j + 1
+            continue
+        depth, k, quote = 1, j + 1, None
+        while k < n and depth:
+            ch = css[k]
+            if quote:
+                if ch == "\\":
+                    k += 1
+                elif ch == quote:
+                    quote = None
+            elif ch in "\"'":
+                quote = ch
+            elif ch == "{":
+                depth += 1
+            elif ch == "}":
+                depth -= 1
+            k += 1
+        rules.append((prelude, css[j + 1 : k - 1]))
+        i = k
+    return rules
+
+
+def selector_matches(selector: str, fold: FoldCollector) -> bool:
+    # Ignore what sits inside :not(...) / :is(...) arguments: keeping a rule
+    # too many is cheaper than missing one.
+    plain = selector
+    while True:
+        match = PSEUDO_ARGS_RE.search(plain)
+        if not match:
+            break
+        depth, k = 1, match.end()
+        while k < len(plain) and depth:
+            depth += {"(": 1, ")": -1}.get(plain[k], 0)
+            k += 1
+        plain = plain[: match.start()] + plain[k:]
+    if any(unescape(c) not in fold.classes for c in CLASS_RE.findall(plain)):
+        return False
+    if any(unescape(i) not in fold.ids for i in ID_RE.findall(plain)):
+        return False
+    if any(a not in fold.attrs for a in ATTR_RE.findall(plain)):
+        return False
+    stripped = CLASS_RE.sub("", ID_RE.sub("", re.sub(r"\[[^\]]*\]", "", plain)))
+    stripped = re.sub(r"::?[\w-]+", "", stripped)
+    return all(t.lower() in fold.tags for t in TAG_RE.findall(stripped))
+
+
+def compact(text: str, punctuation: str = "{};:,>") -> str:
+    text = re.sub(r"\s+", " ", text).strip()
+    return re.sub(r"\s*([%s])\s*" % re.escape(punctuation), r"\1", text).replace(";}", "}")
+
+
+def critical_rules(rules, fold, animations: set[str]) -> list[str]:
+    kept = []
+    for prelude, body in rules:
+        if body is None:
+            continue  # @charset / @import
+        lowered = prelude.lower()
+        if lowered.startswith(("@media", "@supports", "@layer")):
+            inner = critical_rules(parse_rules(body), fold, animations)
+            if inner:
+                kept.append(f"{compact(prelude)}{{{''.join(inner)}}}")
+        elif lowered.startswith("@font-face"):
+            kept.append(f"@font-face{{{compact(body)}}}")
+        elif lowered.startswith("@"):
+            continue  # keyframes are added afterwards, when used
+        else:
+            selectors = [
+                s.strip()
+                for s in split_top_level(prelude)
+                if s.strip() and selector_matches(s.strip(), fold)
+            ]
+            if selectors:
+                for names in ANIMATION_RE.findall(body):
+                    animations.update(re.findall(r"[\w-]+", names))
+                selector_text = ",".join(compact(s, ",>") for s in selectors)
+                kept.append(f"{selector_text}{{{compact(body)}}}")
+    return kept
+
+
+def keyframes_for(rules, animations: set[str]) -> list[str]:
+    found = []
+    for prelude, body in rules:
+        parts = prelude.split()
+        if body is not None and parts and parts[0].lower().endswith("keyframes"):
+            if len(parts) > 1 and parts[1] in animations:
+                found.append(f"{parts[0]} {parts[1]}{{{compact(body)}}}")
+    return found
+
+
+def extract(html: str) -> str:
+    fold = FoldCollector()
+    fold.feed(html)
+    output, animations = [], set()
+    for href in fold.stylesheets:
+        path = static_url_to_path(href)
+        if not path or not os.path.isfile(path):
+            continue  # external CDN stylesheet
+        with open(path, encoding="utf-8") as fh:
+            rules = parse_rules(fh.read())
+        output.extend(critical_rules(rules, fold, animations))
+        output.extend(keyframes_for(rules, animations))
+    return "".join(output)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Extract critical CSS per page.")
+    parser.add_argument(
+        "pages", nargs="*", help=f"Endpoints to build (default: {', '.join(PAGES)})"
+    )
+    args = parser.parse_args()
+
+    if not compiled_tailwind():
+        sys.exit("static/css/tailwind.css is missing; run build_assets.py with the Tailwind CLI first")
+    app.config["CRITICAL_CSS"] = False  # render pages with plain stylesheet links
+    app.config["INIT_DB_ON_REQUEST"] = False  # no seeding, mail or GC threads at build time
+    client = app.test_client()
+    out_dir = os.path.join(app.static_folder, CRITICAL_CSS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    for endpoint in args.pages or PAGES:
+        response = client.get(PAGES[endpoint])
+        if response.status_code != 200:
+            print(f"  WARN: GET {PAGES[endpoint]} returned {response.status_code}, skipped")
+            continue
+        css = extract(response.get_data(as_text=True))
+        with open(os.path.join(out_dir, f"{endpoint}.css"), "w", encoding="utf-8") as fh:
+            fh.write(css)
+        note = "  (over the ~14 KB first round trip)" if len(css) > SIZE_WARNING else ""
+        print(f"  {endpoint:10s} {len(css) / 1024:6.1f} KB{note}")
+
+
+if __name__ == "__main__":
+    main()
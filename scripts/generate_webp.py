@@ -1,88 +1,280 @@
-"""Generate WebP variants for every image under static/.
+"""Generate WebP/AVIF variants and responsive widths for every image under static/.
 
-Run once (or after adding new images):
-    python generate_webp.py
+Run from the project root (or after adding or changing images):
+    python scripts/generate_webp.py
+    python scripts/generate_webp.py --formats webp,avif --widths 480,960,1600
 
-Each .jpg / .jpeg / .png gets a sibling .webp at quality 80.
-Already-existing .webp files are skipped unless --force is passed.
+Each .jpg / .jpeg / .png gets a full-size sibling per format (hero.webp) and
+resized copies for every width below its own (hero-480w.webp, hero-480w.jpg,
+...).  Work is spread over a process pool, one worker per CPU by default.
+
+static/image-manifest.json records each source's sha256, mtime and size next
+to the outputs made from it, so reruns only touch new or changed images (or
+all of them when the widths, formats or quality settings change).  The app
+reads the same manifest to build srcset lists.  Uploads are handled by the
+app's own pipeline and are skipped here.
 """
 
 import argparse
-import glob
+import hashlib
+import json
 import os
+import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from PIL import Image
+from PIL import Image, ImageOps
 
-STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "static"
+)
+MANIFEST_NAME = "image-manifest.json"
+MANIFEST_VERSION = 1
 EXTENSIONS = (".jpg", ".jpeg", ".png")
-WEBP_QUALITY = 80  # good balance of size vs quality
+SKIP_DIRS = ("uploads",)
+# Outputs of this script (-480w) and of build_assets.py (.<hash>) are not sources
+GENERATED_STEM_RE = re.compile(r"(?:-\d+w|\.[0-9a-f]{12})$")
+
+# Defaults mirror the upload pipeline settings in config.py
+DEFAULT_WIDTHS = os.environ.get("IMAGE_VARIANT_WIDTHS", "480,960,1600")
+DEFAULT_FORMATS = os.environ.get("IMAGE_VARIANT_FORMATS", "webp")
+WEBP_QUALITY = int(os.environ.get("IMAGE_WEBP_QUALITY", 80))
+AVIF_QUALITY = int(os.environ.get("IMAGE_AVIF_QUALITY", 55))
+JPEG_QUALITY = 85
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_options(fmt: str, settings: dict) -> dict:
+    if fmt == "webp":
+        return {"format": "WEBP", "quality": settings["webp_quality"], "method": 6}
+    if fmt == "avif":
+        return {"format": "AVIF", "quality": settings["avif_quality"]}
+    if fmt in ("jpg", "jpeg"):
+        return {"format": "JPEG", "quality": JPEG_QUALITY, "optimize": True, "progressive": True}
+    return {"format": "PNG", "optimize": True}
+
+
+def save_variant(img, path: str, fmt: str, settings: dict) -> int:
+    if fmt in ("jpg", "jpeg") and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    tmp_path = path + ".tmp"
+    img.save(tmp_path, **save_options(fmt, settings))
+    os.replace(tmp_path, path)
+    return os.path.getsize(path)
+
 
+def process_image(rel: str, settings: dict) -> dict:
+    """Write every variant of one source image (runs in a worker process)."""
+    src = os.path.join(STATIC_DIR, rel)
+    base, ext = os.path.splitext(rel)
+    ext = ext.lower().lstrip(".")
+    outputs = []
+    with Image.open(src) as opened:
+        img = ImageOps.exif_transpose(opened)
+        if img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+        width, height = img.size
 
-def convert_to_webp(
-    src_path: str, quality: int = WEBP_QUALITY, force: bool = False
-) -> str | None:
-    """Convert a single image to WebP. Returns the output path, or None if skipped."""
-    base, _ = os.path.splitext(src_path)
-    dest = base + ".webp"
+        for fmt in settings["formats"]:
+            out = f"{base}.{fmt}"
+            size = save_variant(img, os.path.join(STATIC_DIR, out), fmt, settings)
+            outputs.append(
+                {"path": out, "format": fmt, "width": width, "height": height, "bytes": size}
+            )
 
-    if os.path.exists(dest) and not force:
-        return None  # already exists
+        for target in settings["widths"]:
+            if target >= width:
+                continue
+            resized = img.resize(
+                (target, max(1, round(height * target / width))), Image.Resampling.LANCZOS
+            )
+            for fmt in list(settings["formats"]) + [ext]:
+                out = f"{base}-{target}w.{fmt}"
+                size = save_variant(resized, os.path.join(STATIC_DIR, out), fmt, settings)
+                outputs.append(
+                    {
+                        "path": out,
+                        "format": fmt if fmt in settings["formats"] else "original",
+                        "width": target,
+                        "height": resized.height,
+                        "bytes": size,
+                    }
+                )
+    return {"width": width, "height": height, "outputs": outputs}
 
+
+def find_sources() -> list[str]:
+    sources = []
+    for dirpath, dirnames, filenames in os.walk(STATIC_DIR):
+        if os.path.abspath(dirpath) == os.path.abspath(STATIC_DIR):
+            dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for name in filenames:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() in EXTENSIONS and not GENERATED_STEM_RE.search(stem):
+                path = os.path.join(dirpath, name)
+                sources.append(os.path.relpath(path, STATIC_DIR).replace(os.sep, "/"))
+    return sorted(sources)
+
+
+def load_manifest(path: str) -> dict:
     try:
-        with Image.open(src_path) as img:
-            # Convert RGBA PNGs properly (WebP supports alpha)
-            if img.mode in ("RGBA", "LA"):
-                img.save(dest, "WEBP", quality=quality, method=4)
-            else:
-                rgb = img.convert("RGB")
-                rgb.save(dest, "WEBP", quality=quality, method=4)
-        return dest
-    except Exception as exc:
-        print(f"  WARN: Could not convert {src_path}: {exc}", file=sys.stderr)
-        return None
+        with open(path, encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get("version") == MANIFEST_VERSION else {}
+
+
+def outputs_exist(entry: dict) -> bool:
+    return all(os.path.exists(os.path.join(STATIC_DIR, o["path"])) for o in entry["outputs"])
+
+
+def remove_outputs(paths) -> None:
+    for rel in paths:
+        try:
+            os.remove(os.path.join(STATIC_DIR, rel))
+        except FileNotFoundError:
+            pass
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(
-        description="Generate WebP variants for static images."
+        description="Generate WebP/AVIF variants and responsive widths for static images."
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Regenerate every image, changed or not"
     )
     parser.add_argument(
-        "--force", action="store_true", help="Re-generate even if .webp already exists"
+        "--widths",
+        default=DEFAULT_WIDTHS,
+        help=f"Comma-separated width ladder (default {DEFAULT_WIDTHS})",
+    )
+    parser.add_argument(
+        "--formats",
+        default=DEFAULT_FORMATS,
+        help=f"Comma-separated output formats: webp, avif (default {DEFAULT_FORMATS})",
     )
     parser.add_argument(
         "--quality",
         type=int,
         default=WEBP_QUALITY,
-        help="WebP quality 1-100 (default 80)",
+        help=f"WebP quality 1-100 (default {WEBP_QUALITY})",
+    )
+    parser.add_argument(
+        "--avif-quality",
+        type=int,
+        default=AVIF_QUALITY,
+        help=f"AVIF quality 1-100 (default {AVIF_QUALITY})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes (default: number of CPUs)",
     )
     args = parser.parse_args()
 
-    sources: list[str] = []
-    for ext in EXTENSIONS:
-        sources.extend(
-            glob.glob(os.path.join(STATIC_DIR, "**", f"*{ext}"), recursive=True)
-        )
+    formats = [f.strip().lower() for f in args.formats.split(",") if f.strip()]
+    Image.init()
+    if "avif" in formats and "AVIF" not in Image.SAVE:
+        print("  WARN: this Pillow build cannot write AVIF; skipping it", file=sys.stderr)
+        formats.remove("avif")
+    settings = {
+        "widths": sorted({int(w) for w in args.widths.split(",") if w.strip()}),
+        "formats": formats,
+        "webp_quality": args.quality,
+        "avif_quality": args.avif_quality,
+    }
 
+    manifest_path = os.path.join(STATIC_DIR, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    images = manifest.get("images", {})
+    settings_changed = manifest.get("settings") != settings
+
+    sources = find_sources()
     print(f"Found {len(sources)} source images under {STATIC_DIR}")
 
-    created, skipped, errors = 0, 0, 0
-    for src in sorted(sources):
-        result = convert_to_webp(src, quality=args.quality, force=args.force)
-        rel = os.path.relpath(src, STATIC_DIR)
-        if result is None and not args.force:
-            skipped += 1
-            print(f"  SKIP  {rel}  (webp exists)")
-        elif result:
-            orig_size = os.path.getsize(src)
-            webp_size = os.path.getsize(result)
-            saving = (1 - webp_size / orig_size) * 100 if orig_size else 0
-            print(f"  OK    {rel}  →  {webp_size:,} B  ({saving:+.0f}%)")
-            created += 1
-        else:
-            errors += 1
-
-    print(f"\nDone: {created} created, {skipped} skipped, {errors} errors")
+    # Decide what changed: mtime+size first, content hash only when those differ
+    todo, unchanged = {}, 0
+    for rel in sources:
+        st = os.stat(os.path.join(STATIC_DIR, rel))
+        entry = images.get(rel)
+        fresh = (
+            entry is not None
+            and not args.force
+            and not settings_changed
+            and outputs_exist(entry)
+        )
+        if fresh and entry["mtime"] == st.st_mtime and entry["size"] == st.st_size:
+            unchanged += 1
+            continue
+        sha256 = file_sha256(os.path.join(STATIC_DIR, rel))
+        if fresh and entry["sha256"] == sha256:
+            entry.update(mtime=st.st_mtime, size=st.st_size)  # touched, not changed
+            unchanged += 1
+            continue
+        todo[rel] = {"sha256": sha256, "mtime": st.st_mtime, "size": st.st_size}
+
+    # Sources that disappeared take their outputs with them
+    for rel in set(images) - set(sources):
+        remove_outputs(o["path"] for o in images.pop(rel)["outputs"])
+
+    started = time.monotonic()
+    total_original = total_best = errors = 0
+    workers = max(1, min(args.workers, len(todo) or 1))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_image, rel, settings): rel for rel in todo}
+        for future in as_completed(futures):
+            rel = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                errors += 1
+                print(f"  WARN: Could not convert {rel}: {exc}", file=sys.stderr)
+                continue
+            old = images.get(rel)
+            if old:
+                kept = {o["path"] for o in result["outputs"]}
+                remove_outputs(o["path"] for o in old["outputs"] if o["path"] not in kept)
+            images[rel] = {**todo[rel], **result}
+
+            original = todo[rel]["size"]
+            full_size = [o["bytes"] for o in result["outputs"] if o["width"] == result["width"]]
+            best = min(full_size + [original])
+            total_original += original
+            total_best += best
+            saving = (1 - best / original) * 100 if original else 0
+            print(
+                f"  OK    {rel}  {original:,} B → {best:,} B  ({saving:+.0f}%), "
+                f"{len(result['outputs'])} files"
+            )
+
+    manifest = {"version": MANIFEST_VERSION, "settings": settings, "images": images}
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    elapsed = time.monotonic() - started
+    saved = total_original - total_best
+    print(
+        f"\nDone: {len(todo) - errors} converted, {unchanged} unchanged, {errors} errors "
+        f"in {elapsed:.1f}s with {workers} workers"
+    )
+    if total_original:
+        print(
+            f"Full-size bytes: {total_original:,} → {total_best:,} "
+            f"({saved:,} B saved, {saved / total_original:.0%})"
+        )
 
 
 if __name__ == "__main__":
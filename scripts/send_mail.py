@@ -0,0 +1,74 @@
+"""Deliver queued outbound email.
+
+Run from the project root:
+    python scripts/send_mail.py           # keep delivering, polling the outbox
+    python scripts/send_mail.py --once    # send what is due now, then exit
+    python scripts/send_mail.py --status  # count outbox rows by status
+
+Use it with MAIL_DELIVERY=external (from cron or as a separate process); it
+is also safe to run next to the in-process delivery threads.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import (  # noqa: E402
+    OutboundEmail,
+    SMTPTransport,
+    app,
+    db,
+    deliver_pending_emails,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Deliver queued outbound email.")
+    parser.add_argument(
+        "--once", action="store_true", help="Send what is due now, then exit"
+    )
+    parser.add_argument(
+        "--status", action="store_true", help="Print outbox counts by status and exit"
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=app.config["MAIL_POLL_INTERVAL"],
+        help="Seconds between polls (default MAIL_POLL_INTERVAL)",
+    )
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.create_all()
+        if args.status:
+            rows = db.session.execute(
+                db.select(OutboundEmail.status, db.func.count()).group_by(OutboundEmail.status)
+            ).all()
+            for status, count in sorted(rows):
+                print(f"  {status:8s} {count:6d}")
+            return
+
+        transport = SMTPTransport(app.config)
+        try:
+            while True:
+                counts = deliver_pending_emails(transport)
+                if any(counts.values()):
+                    print(
+                        f"Sent {counts['sent']}, will retry {counts['pending']}, "
+                        f"failed {counts['failed']}"
+                    )
+                if args.once:
+                    break
+                time.sleep(args.interval)
+                transport.close_if_idle()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            transport.close()
+
+
+if __name__ == "__main__":
+    main()
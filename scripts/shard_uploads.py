@@ -0,0 +1,42 @@
+"""Move flat uploads into the sharded `<subdir>/<ab>/<cd>/<name>` layout.
+
+Run from the project root:
+    python scripts/shard_uploads.py --dry-run   # report only
+    python scripts/shard_uploads.py             # move files, rewrite image URLs
+
+Safe to re-run.  Old flat URLs keep resolving via a redirect to the new path.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, shard_existing_uploads  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shard the upload directory.")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Report what would be moved"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="Rows per UPDATE batch (default 500)",
+    )
+    args = parser.parse_args()
+
+    with app.app_context():
+        report = shard_existing_uploads(dry_run=args.dry_run, batch_size=args.batch_size)
+
+    verb = "Would move" if report["dry_run"] else "Moved"
+    print(f"{verb} {report['moved']} files under {app.config['UPLOAD_FOLDER']}")
+    for column, count in report["rewritten"].items():
+        print(f"  {column:28s} {count:6d} URLs")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
 """Comprehensive smoke test for all routes (public + admin + WhatsApp)."""
 
+import re
+
 from app import app, db, csrf
 
 
 def main():
     app.config["WTF_CSRF_ENABLED"] = False
+    # Keep rate limit state to this run; the default SQLite file is shared
+    # with the running app and earlier runs
+    app.config["RATE_LIMIT_STORAGE"] = "memory"
     c = app.test_client()
 
     # --- Public routes ---
@@ -75,9 +80,13 @@ def main():
     # --- WhatsApp contact redirect ---
     print()
     print("=== WHATSAPP CONTACT ===")
+    app.config["CONTACT_MIN_SUBMIT_SECONDS"] = 0
+    page = c.get("/contact").get_data(as_text=True)
+    token = re.search(r'name="form_ts" value="([^"]+)"', page)
     resp = c.post(
         "/contact",
         data={
+            "form_ts": token.group(1) if token else "",
             "name": "Test",
             "email": "test@test.com",
             "phone": "0881234567",
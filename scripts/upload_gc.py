@@ -0,0 +1,73 @@
+"""Delete (or quarantine) uploaded files no database row refers to.
+
+Run from the project root:
+    python scripts/upload_gc.py --dry-run     # report only
+    python scripts/upload_gc.py               # delete orphans past the grace period
+    python scripts/upload_gc.py --quarantine  # move them to uploads/.quarantine/
+
+Also prints disk usage per upload subdirectory.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, collect_upload_garbage  # noqa: E402
+
+
+def human_size(num_bytes: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            return f"{num_bytes:,.0f} {unit}" if unit == "B" else f"{num_bytes:,.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes} B"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Clean up orphaned uploads.")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Report what would be removed"
+    )
+    parser.add_argument(
+        "--quarantine",
+        action="store_true",
+        help="Move orphans to uploads/.quarantine/<date>/ instead of deleting",
+    )
+    parser.add_argument(
+        "--grace-hours",
+        type=float,
+        default=None,
+        help="Keep orphans younger than this (default UPLOAD_GC_GRACE_SECONDS)",
+    )
+    args = parser.parse_args()
+
+    grace = None if args.grace_hours is None else int(args.grace_hours * 3600)
+    with app.app_context():
+        report = collect_upload_garbage(
+            dry_run=args.dry_run,
+            quarantine=args.quarantine or None,
+            grace_seconds=grace,
+        )
+
+    print(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
+    print(f"{'subdir':20s} {'files':>7s} {'size':>11s} {'orphans':>8s} {'orphan size':>12s}")
+    total_files = total_bytes = 0
+    for name, stats in sorted(report["subdirs"].items()):
+        total_files += stats["files"]
+        total_bytes += stats["bytes"]
+        print(
+            f"{name:20s} {stats['files']:7d} {human_size(stats['bytes']):>11s} "
+            f"{stats['orphans']:8d} {human_size(stats['orphan_bytes']):>12s}"
+        )
+    print(f"{'total':20s} {total_files:7d} {human_size(total_bytes):>11s}")
+
+    verb = "Would remove" if report["dry_run"] else "Removed"
+    print(f"\n{verb} {len(report['removed'])} files")
+    for url in report["removed"]:
+        print(f"  {url}")
+
+
+if __name__ == "__main__":
+    main()